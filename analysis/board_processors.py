@@ -1,53 +1,132 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import os
-import glob
 import re
 
+from itertools import islice
+
+from manifest import find_data_files
 from waveform_processor import WaveformProcessor
 
 
 
 
 
+def read_tek_header(file, n_lines=21):
+    """Key/value settings from the header of a Tek csv, e.g. 'Vertical Scale'. Values are for the first channel."""
+    metadata = {}
+    with open(file) as f:
+        for line in islice(f, n_lines):
+            fields = line.strip().split(',')
+            if len(fields) > 1 and fields[0] and fields[1]:
+                try:
+                    metadata[fields[0]] = float(fields[1])
+                except ValueError:
+                    metadata[fields[0]] = fields[1]
+    return metadata
+
+
+def read_lecroy(file, chunk_segments=256):
+    """
+    Read a LeCroy WaveRunner text export, single shot or sequence mode.
+    Returns (time, amplitude, metadata) with time and amplitude arrays of shape segments x samples,
+    time being relative to each segment's trigger. metadata has Segments, SegmentSize, the
+    per-segment TrigTime strings and TimeSinceSegment1 (s). Samples are decoded chunk_segments
+    segments at a time straight into the output arrays, missing samples are left as NaN.
+    """
+    with open(file) as f:
+        model = f.readline().strip().split(',')
+        fields = f.readline().strip().split(',')
+        n_segments, segment_size = int(fields[1]), int(fields[3])
+        f.readline() # Segment,TrigTime,TimeSinceSegment1
+        trig_times = []
+        time_since_first = np.empty(n_segments)
+        for i in range(n_segments):
+            fields = f.readline().strip().split(',')
+            trig_times.append(fields[1].strip())
+            time_since_first[i] = float(fields[2])
+        f.readline() # Time,Ampl
+        samples = np.full((2, n_segments * segment_size), np.nan)
+        row = 0
+        for chunk in pd.read_csv(f, names=["time", "amplitude"], chunksize=chunk_segments * segment_size):
+            values = chunk.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float).T
+            n = min(values.shape[1], samples.shape[1] - row)
+            samples[:, row:row+n] = values[:, :n]
+            row += n
+    metadata = {
+        'Model': model[0],
+        'Segments': n_segments,
+        'SegmentSize': segment_size,
+        'TrigTime': trig_times,
+        'TimeSinceSegment1': time_since_first,
+    }
+    time, amplitude = samples.reshape(2, n_segments, segment_size)
+    return time, amplitude, metadata
+
+
+def add_lecroy_traces(processor, channel, waveform_type, first_trace, file, invert=False, traces=None):
+    """
+    Store every segment of a LeCroy file as a trace, numbered first_trace ... first_trace+N-1
+    for N segments (see manifest.find_data_files), each keeping its trigger time.
+    If traces is given only segments whose trace number is in it are stored.
+    Returns the number of segments.
+    """
+    time, amplitude, metadata = read_lecroy(file)
+    if invert:
+        amplitude = amplitude * -1
+    n_segments = metadata['Segments']
+    segments = [s for s in range(n_segments) if traces is None or first_trace + s in traces]
+    existing = processor.channels.get(channel, {}).get(waveform_type, {})
+    taken = [first_trace + s for s in segments if first_trace + s in existing]
+    if taken:
+        raise ValueError(f"Traces {taken[0]}...{taken[-1]} of channel {channel} {waveform_type} are already loaded")
+    for segment in segments:
+        df = pd.DataFrame({"time": time[segment], "output": amplitude[segment]})
+        segment_metadata = {
+            'Model': metadata['Model'],
+            'Segments': n_segments,
+            'SegmentSize': metadata['SegmentSize'],
+            'Segment': segment,
+            'TrigTime': metadata['TrigTime'][segment],
+            'TimeSinceSegment1': float(metadata['TimeSinceSegment1'][segment]),
+        }
+        processor.add_trace(channel, waveform_type, first_trace + segment, df, file, segment_metadata)
+    return n_segments
+
+
+
+
+
 class CASB1Processor(WaveformProcessor):
     
     def __init__(self):
         super().__init__(name="CASB1")
     
-    def load_singles(self, path="../data/casb1/singles/C1--Trace--*.txt"):
-        files = glob.glob(path)
+    def parse_filename(self, file, waveform_type):
+        """(channel, trace_num) from a data file name, trace_num None if it has to come from load order"""
+        filename = os.path.basename(file)
+        if waveform_type == 'singles':
+            match = re.search(r'C(\d+)--Trace--(\d+)', filename)
+            if match:
+                return int(match.group(1)), int(match.group(2))
+            match = re.search(r'Trace--(\d+)', filename)
+            if match:
+                return 1, int(match.group(1))  # Default if no channel in filename
+            return None
+        match = re.search(r'ch(\d+)', filename)
+        if match:
+            return int(match.group(1)), None
+        return None
+    
+    def load_singles(self, path="../data/casb1/singles/C1--Trace--*.txt", channels=None, traces=None):
+        files = find_data_files(self, path, 'singles', channels, traces)
         if not files:
             print(f"Warning: No files found matching pattern: {path}")
             return {}
         files_per_channel = {}
-        for file in files:
+        for file, channel, trace_num in files:
             try:
-                filename = os.path.basename(file)
-                match = re.search(r'C(\d+)--Trace--(\d+)', filename)
-                if match:
-                    channel = int(match.group(1))
-                    trace_num = int(match.group(2))
-                else:
-                    match = re.search(r'Trace--(\d+)', filename)
-                    if match:
-                        trace_num = int(match.group(1))
-                        channel = 1  # Default if no channel in filename
-                    else:
-                        print(f"Could not extract info from {filename}, skipping")
-                        continue
-                df = pd.read_csv(file, skiprows=6, names=["time", "output"])
-                for col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-                if channel not in self.channels:
-                    self.channels[channel] = {}
-                if 'singles' not in self.channels[channel]:
-                    self.channels[channel]['singles'] = {}
-                self.channels[channel]['singles'][trace_num] = {
-                    'data': df,
-                    'analysis': {}
-                }
+                add_lecroy_traces(self, channel, 'singles', trace_num, file, traces=traces)
                 if channel in files_per_channel:
                     files_per_channel[channel] += 1
                 else:
@@ -58,37 +137,19 @@ class CASB1Processor(WaveformProcessor):
         print(f"Loaded {total_files} singles files across {len(files_per_channel)} channels for {self.name}")
         return files_per_channel
     
-    def load_averages(self, path):
-        files = glob.glob(path)
+    def load_averages(self, path, channels=None, traces=None):
+        files = find_data_files(self, path, 'averages', channels, traces)
         if not files:
             print(f"Warning: No files found matching pattern: {path}")
             return {}
         files_per_channel = {}
-        for file in files:
+        for file, channel, trace_num in files:
             try:
-                filename = os.path.basename(file)
-                match = re.search(r'ch(\d+)', filename)
-                if match:
-                    channel = int(match.group(1))
-                else:
-                    print(f"Could not extract channel from {filename}, skipping")
-                    continue
-                if channel in files_per_channel:
-                    trace_num = files_per_channel[channel]
-                else:
-                    trace_num = 0
                 df = pd.read_csv(file, skiprows=21, names=["time", "output", "CH3", "input"])
                 for col in df.columns:
                     df[col] = pd.to_numeric(df[col], errors='coerce')
                 df = df[["time", "output", "input"]] if "input" in df.columns else df[["time", "output"]]
-                if channel not in self.channels:
-                    self.channels[channel] = {}
-                if 'averages' not in self.channels[channel]:
-                    self.channels[channel]['averages'] = {}
-                self.channels[channel]['averages'][trace_num] = {
-                    'data': df,
-                    'analysis': {}
-                }
+                self.add_trace(channel, 'averages', trace_num, df, file, read_tek_header(file))
                 if channel in files_per_channel:
                     files_per_channel[channel] += 1
                 else:
@@ -117,47 +178,28 @@ class CASB2Processor(WaveformProcessor):
     def __init__(self):
         super().__init__(name="CASB2")
     
-    def load_singles(self, path):
-        files = glob.glob(path)
+    def parse_filename(self, file, waveform_type=None):
+        filename = os.path.basename(file)
+        ch_dir = os.path.basename(os.path.dirname(file))
+        ch_match = re.search(r'ch(\d+)', ch_dir) or re.search(r'ch(\d+)', filename)
+        if not ch_match:
+            return None
+        trace_match = re.search(r'tek(\d+)ALL', filename)
+        return int(ch_match.group(1)), int(trace_match.group(1)) if trace_match else None
+    
+    def load_singles(self, path, channels=None, traces=None):
+        files = find_data_files(self, path, 'singles', channels, traces)
         if not files:
             print(f"Warning: No files found matching pattern: {path}")
             return {}
         files_per_channel = {}
-        for file in files:
+        for file, channel, trace_num in files:
             try:
-                filename = os.path.basename(file)
-                ch_dir = os.path.basename(os.path.dirname(file))
-                ch_match = re.search(r'ch(\d+)', ch_dir)
-                if ch_match:
-                    channel = int(ch_match.group(1))
-                else:
-                    ch_match = re.search(r'ch(\d+)', filename)
-                    if ch_match:
-                        channel = int(ch_match.group(1))
-                    else:
-                        print(f"Could not extract channel from {file}, skipping")
-                        continue
-                trace_match = re.search(r'tek(\d+)ALL', filename)
-                if trace_match:
-                    trace_num = int(trace_match.group(1))
-                else:
-                    if channel in files_per_channel:
-                        trace_num = files_per_channel[channel]
-                    else:
-                        trace_num = 0
-                
                 df = pd.read_csv(file, skiprows=21, names=["time", "output", "input"])
                 for col in df.columns:
                     df[col] = pd.to_numeric(df[col], errors='coerce')
                 df = df[["time", "output", "input"]] if "input" in df.columns else df[["time", "output"]]
-                if channel not in self.channels:
-                    self.channels[channel] = {}
-                if 'singles' not in self.channels[channel]:
-                    self.channels[channel]['singles'] = {}
-                self.channels[channel]['singles'][trace_num] = {
-                    'data': df,
-                    'analysis': {}
-                }
+                self.add_trace(channel, 'singles', trace_num, df, file, read_tek_header(file))
                 if channel in files_per_channel:
                     files_per_channel[channel] += 1
                 else:
@@ -171,52 +213,22 @@ class CASB2Processor(WaveformProcessor):
         
         return files_per_channel
     
-    def load_averages(self, path):
-        files = glob.glob(path)
+    def load_averages(self, path, channels=None, traces=None):
+        files = find_data_files(self, path, 'averages', channels, traces)
         if not files:
             print(f"Warning: No files found matching pattern: {path}")
             return {}
             
         files_per_channel = {}
         
-        for file in files:
+        for file, channel, trace_num in files:
             try:
-                filename = os.path.basename(file)
-                ch_dir = os.path.basename(os.path.dirname(file))
-                ch_match = re.search(r'ch(\d+)', ch_dir)
-                if ch_match:
-                    channel = int(ch_match.group(1))
-                else:
-                    ch_match = re.search(r'ch(\d+)', filename)
-                    if ch_match:
-                        channel = int(ch_match.group(1))
-                    else:
-                        print(f"Could not extract channel from {file}, skipping")
-                        continue
-                trace_match = re.search(r'tek(\d+)ALL', filename)
-                if trace_match:
-                    trace_num = int(trace_match.group(1))
-                else:
-                    if channel in files_per_channel:
-                        trace_num = files_per_channel[channel]
-                    else:
-                        trace_num = 0
-                
                 df = pd.read_csv(file, skiprows=21, names=["time", "output", "input"])
                 for col in df.columns:
                     df[col] = pd.to_numeric(df[col], errors='coerce')
                 df = df[["time", "output", "input"]] if "input" in df.columns else df[["time", "output"]]
                 
-                if channel not in self.channels:
-                    self.channels[channel] = {}
-                
-                if 'averages' not in self.channels[channel]:
-                    self.channels[channel]['averages'] = {}
-                
-                self.channels[channel]['averages'][trace_num] = {
-                    'data': df,
-                    'analysis': {}
-                }
+                self.add_trace(channel, 'averages', trace_num, df, file, read_tek_header(file))
                 
                 if channel in files_per_channel:
                     files_per_channel[channel] += 1
@@ -257,50 +269,33 @@ class MTCAProcessor(WaveformProcessor):
     def __init__(self):
         super().__init__(name="MTCA1")
     
-    def load_singles(self, path):
-        files = glob.glob(path)
+    def parse_filename(self, file, waveform_type):
+        filename = os.path.basename(file)
+        if waveform_type == 'singles':
+            match = re.search(r'C(\d+)--Trace--(\d+)', filename)
+            if match:
+                return int(match.group(1)), int(match.group(2))
+            match = re.search(r'Trace--(\d+)', filename)
+            if match:
+                return 4, int(match.group(1))  # Default if not specified
+            return None
+        match = re.search(r'ch(\d+)', filename)
+        if match:
+            return int(match.group(1)), None
+        return None
+    
+    def load_singles(self, path, channels=None, traces=None):
+        files = find_data_files(self, path, 'singles', channels, traces)
         if not files:
             print(f"Warning: No files found matching pattern: {path}")
             return {}
             
         files_per_channel = {}
         
-        for file in files:
+        for file, channel, trace_num in files:
             try:
-                filename = os.path.basename(file)
-                
-                # Extract channel and trace info
-                match = re.search(r'C(\d+)--Trace--(\d+)', filename)
-                if match:
-                    channel = int(match.group(1))
-                    trace_num = int(match.group(2))
-                else:
-                    match = re.search(r'Trace--(\d+)', filename)
-                    if match:
-                        trace_num = int(match.group(1))
-                        channel = 4  # Default if not specified
-                    else:
-                        print(f"Could not extract info from {filename}, skipping")
-                        continue
-                
-                # Load data - adjust skiprows based on your file format
-                df = pd.read_csv(file, skiprows=6, names=["time", "output"])
-                for col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-                df['output'] = df['output'] * -1
-                # Initialize channel structure if needed
-                if channel not in self.channels:
-                    self.channels[channel] = {}
-                
-                # Initialize singles dict if needed
-                if 'singles' not in self.channels[channel]:
-                    self.channels[channel]['singles'] = {}
-                
-                # Store the trace
-                self.channels[channel]['singles'][trace_num] = {
-                    'data': df,
-                    'analysis': {}
-                } 
+                # Load data, one trace per segment
+                add_lecroy_traces(self, channel, 'singles', trace_num, file, invert=True, traces=traces)
                 
                 # Update counter
                 if channel in files_per_channel:
@@ -317,48 +312,18 @@ class MTCAProcessor(WaveformProcessor):
         
         return files_per_channel
     
-    def load_averages(self, path):
-        files = glob.glob(path)
+    def load_averages(self, path, channels=None, traces=None):
+        files = find_data_files(self, path, 'averages', channels, traces)
         if not files:
             print(f"Warning: No files found matching pattern: {path}")
             return {}
             
         files_per_channel = {}
         
-        for file in files:
+        for file, channel, trace_num in files:
             try:
-                filename = os.path.basename(file)
-                match = re.search(r'ch(\d+)', filename)
-                if match:
-                    channel = int(match.group(1))
-                else:
-                    print(f"Could not extract channel from {filename}, skipping")
-                    continue
-                
-                # Extract trace number if available, otherwise use counter
-                if channel in files_per_channel:
-                    trace_num = files_per_channel[channel]
-                else:
-                    trace_num = 0
-                
-                # Load data - adjust skiprows based on your file format
-                df = pd.read_csv(file, skiprows=6, names=["time", "output"])
-                for col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-                
-                # Initialize channel structure if needed
-                if channel not in self.channels:
-                    self.channels[channel] = {}
-                
-                # Initialize singles dict if needed
-                if 'averages' not in self.channels[channel]:
-                    self.channels[channel]['averages'] = {}
-                
-                # Store the trace
-                self.channels[channel]['averages'][trace_num] = {
-                    'data': df,
-                    'analysis': {}
-                } 
+                # Load data, one trace per segment
+                add_lecroy_traces(self, channel, 'averages', trace_num, file, traces=traces)
                 
                 # Update counter
                 if channel in files_per_channel:
@@ -392,3 +357,13 @@ class MTCAProcessor(WaveformProcessor):
                 print(f"Warning: Could not load averages with default path: {e}")
         
         return len(singles_result), len(averages_result)
+
+
+
+
+
+PROCESSORS = {
+    'CASB1': CASB1Processor,
+    'CASB2': CASB2Processor,
+    'MTCA1': MTCAProcessor,
+}
@@ -0,0 +1,113 @@
+import sqlite3
+import hashlib
+import json
+import os
+import time
+
+
+
+
+
+class CalibrationDB:
+    """
+    SQLite store of per-channel calibration constants (delays, gains, rise times).
+    Constants are keyed by board, channel, dataset and the analysis parameter set, and
+    each channel remembers a fingerprint of its input files so unchanged channels are not reanalysed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS constants (
+                board TEXT, channel INTEGER, dataset TEXT, param_set TEXT,
+                parameter TEXT, value REAL, n_traces INTEGER, created REAL,
+                PRIMARY KEY (board, channel, dataset, param_set, parameter)
+            );
+            CREATE INDEX IF NOT EXISTS constants_lookup ON constants (board, parameter, created);
+            CREATE TABLE IF NOT EXISTS inputs (
+                board TEXT, channel INTEGER, dataset TEXT, param_set TEXT,
+                fingerprint TEXT, updated REAL,
+                PRIMARY KEY (board, channel, dataset, param_set)
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def make_param_set(params):
+        return json.dumps(params, sort_keys=True)
+
+    @staticmethod
+    def fingerprint(files, traces=None):
+        """
+        Hash of path, size and mtime of the input files, None if any file is unknown.
+        traces, e.g. the trace numbers that passed screening, are hashed in too if given.
+        """
+        if not files or any(f is None for f in files):
+            return None
+        h = hashlib.sha1()
+        for f in sorted(files):
+            st = os.stat(f)
+            h.update(f"{os.path.abspath(f)}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+        if traces is not None:
+            h.update(f"traces|{','.join(str(t) for t in sorted(traces))}\n".encode())
+        return h.hexdigest()
+
+    def is_current(self, board, channel, dataset, param_set, fingerprint):
+        if fingerprint is None:
+            return False
+        row = self.conn.execute(
+            "SELECT fingerprint FROM inputs WHERE board=? AND channel=? AND dataset=? AND param_set=?",
+            (board, channel, dataset, param_set)).fetchone()
+        return row is not None and row[0] == fingerprint
+
+    def write_channel(self, board, channel, dataset, param_set, constants, n_traces, fingerprint=None):
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM constants WHERE board=? AND channel=? AND dataset=? AND param_set=?",
+                (board, channel, dataset, param_set))
+            self.conn.executemany(
+                "INSERT INTO constants VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(board, channel, dataset, param_set, parameter, float(value), n_traces, now)
+                 for parameter, value in constants.items()])
+            self.conn.execute(
+                "INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?, ?, ?)",
+                (board, channel, dataset, param_set, fingerprint, now))
+
+    def latest_run(self, board, dataset=None, param_set=None):
+        """(dataset, param_set) most recently written for a board, optionally within one dataset or parameter set"""
+        query = "SELECT dataset, param_set FROM inputs WHERE board=?"
+        args = [board]
+        if dataset is not None:
+            query += " AND dataset=?"
+            args.append(dataset)
+        if param_set is not None:
+            query += " AND param_set=?"
+            args.append(param_set)
+        row = self.conn.execute(query + " ORDER BY updated DESC, rowid DESC LIMIT 1", args).fetchone()
+        return None if row is None else tuple(row)
+
+    def get_table(self, board, parameter, dataset=None, param_set=None):
+        """
+        Value of a parameter for every channel of a board, e.g. get_table('CASB2', 'delay').
+        All values come from one dataset and parameter set; when either is omitted it is the one
+        most recently written for the board (see latest_run), never a mix across channels.
+        """
+        if dataset is None or param_set is None:
+            run = self.latest_run(board, dataset, param_set)
+            if run is None:
+                return {}
+            dataset, param_set = run
+        rows = self.conn.execute(
+            "SELECT channel, value FROM constants WHERE board=? AND parameter=? AND dataset=? AND param_set=? ORDER BY channel",
+            (board, parameter, dataset, param_set))
+        return {channel: value for channel, value in rows}
+
+    def get_datasets(self, board=None):
+        if board is None:
+            rows = self.conn.execute("SELECT DISTINCT board, dataset FROM inputs ORDER BY board, dataset")
+        else:
+            rows = self.conn.execute("SELECT DISTINCT board, dataset FROM inputs WHERE board=? ORDER BY dataset", (board,))
+        return [tuple(row) for row in rows]
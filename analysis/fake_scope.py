@@ -0,0 +1,88 @@
+import asyncio
+
+import numpy as np
+
+from stream_ingest import encode_frame
+
+
+
+
+
+class FakeScopeServer:
+    """
+    Local stand-in for a streaming scope, to exercise stream_ingest.ingest without hardware.
+    Serves a fixed list of (header, data) frames to every client that connects, waiting on
+    the socket drain between frames so a slow client applies backpressure.
+
+        async with FakeScopeServer(synthetic_frames(100)) as scope:
+            await ingest(processor, scope.host, scope.port, analysis_params=...)
+    """
+    def __init__(self, frames, host='127.0.0.1', port=0):
+        self.frames = list(frames)
+        self.host = host
+        self.port = port
+        self.server = None
+        self.frames_sent = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _serve(self, reader, writer):
+        try:
+            for header, data in self.frames:
+                writer.write(encode_frame(header, data))
+                await writer.drain()
+                self.frames_sent += 1
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def frames_from_processor(processor, waveform_type):
+    """Replay a loaded dataset as frames"""
+    frames = []
+    for channel in sorted(processor.channels):
+        for trace_num, trace in sorted(processor.channels[channel].get(waveform_type, {}).items()):
+            df = trace['data']
+            header = {'Model': processor.name, 'channel': channel, 'trace': trace_num,
+                      'Record Length': len(df), 'Sample Interval': float(np.median(np.diff(df["time"].values))),
+                      'columns': list(df.columns)}
+            frames.append((header, df.values.T))
+    return frames
+
+
+def synthetic_frames(n_traces, channels=(1,), n_samples=1000, sample_interval=4e-10, amplitude=0.05, delay=30e-9, noise=1e-3, seed=0):
+    """
+    CASB-like frames: an input pulse and a delayed output pulse with 2-3 ns rise times on a
+    small pedestal plus gaussian noise, in volts and seconds like the Tek files.
+    """
+    rng = np.random.default_rng(seed)
+    time = (np.arange(n_samples) - n_samples // 10) * sample_interval
+    frames = []
+    for channel in channels:
+        for trace_num in range(n_traces):
+            t0 = 20e-9 + rng.normal(0, 0.2e-9)
+            pulse_in = amplitude / (1 + np.exp(-(time - t0) / 0.6e-9)) * np.exp(-np.clip(time - t0, 0, None) / 50e-9)
+            pulse_out = 0.9 * amplitude / (1 + np.exp(-(time - t0 - delay) / 1.0e-9)) * np.exp(-np.clip(time - t0 - delay, 0, None) / 50e-9)
+            data = np.stack([time,
+                             0.09 + pulse_out + rng.normal(0, noise, n_samples),
+                             0.005 + pulse_in + rng.normal(0, noise, n_samples)])
+            header = {'Model': 'FakeScope', 'channel': channel, 'trace': trace_num,
+                      'Record Length': n_samples, 'Sample Interval': sample_interval,
+                      'Vertical Scale': 0.02, 'Vertical Offset': 0.0, 'Vertical Position': -4.98,
+                      'columns': ["time", "output", "input"]}
+            frames.append((header, data))
+    return frames
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+
+
+
+# All filters act along the last (sample) axis of a traces x samples array, so a whole
+# channel is processed in one call. Recursive filters still have to step through the
+# samples in order, but each step is vectorized across every trace.
+
+def subtract_pedestal(data, baseline_start_pct, baseline_end_pct):
+    start_idx = int(data.shape[-1] * baseline_start_pct)
+    end_idx = int(data.shape[-1] * baseline_end_pct)
+    pedestal = np.mean(data[..., start_idx:end_idx+1], axis=-1, keepdims=True)
+    return data - pedestal
+
+
+def moving_average_kernel(n_samples):
+    return np.ones(n_samples) / n_samples
+
+
+def fir_filter(data, kernel):
+    """
+    Centered FIR filter, so symmetric kernels do not shift the pulse in time.
+    Edges are padded with the first/last sample.
+    """
+    kernel = np.asarray(kernel, dtype=float)
+    n = len(kernel)
+    padded = np.pad(data, [(0, 0)] * (data.ndim - 1) + [((n-1)//2, n//2)], mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, n, axis=-1)
+    return windows @ kernel[::-1]
+
+
+def iir_filter(data, b, a):
+    """
+    Direct form IIR filter y[n] = (sum b[k]x[n-k] - sum a[k]y[n-k]) / a[0].
+    The filter starts in its steady state for the first sample so a non-zero
+    pedestal does not ring at the start of the trace.
+    """
+    b = np.asarray(b, dtype=float)
+    a = np.asarray(a, dtype=float)
+    b = b / a[0]
+    a = a / a[0]
+    dc_gain = np.sum(b) / np.sum(a)
+    x_padded = np.concatenate([np.repeat(data[..., :1], len(b)-1, axis=-1), data], axis=-1)
+    feedforward = np.lib.stride_tricks.sliding_window_view(x_padded, len(b), axis=-1) @ b[::-1]
+    if len(a) == 1:
+        return feedforward
+    order = len(a) - 1
+    y = np.empty(data.shape[:-1] + (data.shape[-1] + order,))
+    y[..., :order] = data[..., :1] * dc_gain
+    for i in range(data.shape[-1]):
+        n = i + order
+        y[..., n] = feedforward[..., i] - y[..., n-order:n] @ a[:0:-1]
+    return y[..., order:]
+
+
+def single_pole_lowpass(tau, dt):
+    """(b, a) coefficients of an RC low pass with time constant tau, for use with iir_filter"""
+    alpha = dt / (tau + dt)
+    return [alpha], [1, alpha - 1]
+
+
+def baseline_restoration(data, dt, tau):
+    """
+    Emulate the AC coupled output with the diode baseline restorer (see README schematic).
+    The coupling capacitor charges towards the input with time constant tau, and the
+    diodes stop the output from undershooting the baseline. Expects pedestal subtracted data.
+    """
+    alpha = dt / (tau + dt)
+    out = np.empty_like(data, dtype=float)
+    v_cap = data[..., 0].astype(float)
+    for i in range(data.shape[-1]):
+        np.minimum(v_cap, data[..., i], out=v_cap)
+        out[..., i] = data[..., i] - v_cap
+        v_cap += alpha * out[..., i]
+    return out
+
+
+def apply_filters(data, dt, fir=None, iir=None, blr_tau=None, pedestal=None):
+    """
+    Run the preprocessing chain: pedestal subtraction, FIR smoothing, IIR filter and
+    baseline restoration emulation, skipping any stage left as None.
+    fir is a kernel or an integer moving average length, iir is a (b, a) pair,
+    blr_tau is in the same units as dt and pedestal is (baseline_start_pct, baseline_end_pct).
+    """
+    out = np.asarray(data, dtype=float)
+    if pedestal is not None:
+        out = subtract_pedestal(out, *pedestal)
+    if fir is not None:
+        if np.isscalar(fir):
+            fir = moving_average_kernel(int(fir))
+        out = fir_filter(out, fir)
+    if iir is not None:
+        out = iir_filter(out, *iir)
+    if blr_tau is not None:
+        out = baseline_restoration(out, dt, blr_tau)
+    return out
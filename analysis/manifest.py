@@ -0,0 +1,208 @@
+import fnmatch
+import json
+import os
+
+
+
+
+
+# Per data directory index of the waveform files under it, saved as .manifest.json in that
+# directory. For every board and waveform type it records each file's channel, trace number,
+# format, sample count, size and mtime. Files are only parsed when new or changed, and trace
+# numbers that have to be assigned (files without one in the name) are kept between runs.
+
+MANIFEST_NAME = '.manifest.json'
+
+
+def split_pattern(path):
+    """Directory before the first wildcard, where the manifest lives, and the remaining pattern components"""
+    parts = path.split('/')
+    for i, part in enumerate(parts):
+        if any(c in part for c in '*?['):
+            break
+    else:
+        i = len(parts) - 1
+    root = '/'.join(parts[:i]) or ('/' if path.startswith('/') else '.')
+    return root, parts[i:]
+
+
+def _scan(directory, pattern_parts, prefix=''):
+    """(relative path, stat) of files matching the pattern, one directory level per component like glob"""
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    part = pattern_parts[0]
+    for entry in entries:
+        if entry.name.startswith('.') and not part.startswith('.'):
+            continue
+        if not fnmatch.fnmatch(entry.name, part):
+            continue
+        if len(pattern_parts) == 1:
+            if entry.is_file():
+                yield prefix + entry.name, entry.stat()
+        elif entry.is_dir():
+            yield from _scan(entry.path, pattern_parts[1:], prefix + entry.name + '/')
+
+
+def _matches(rel, pattern_parts):
+    parts = rel.split('/')
+    return len(parts) == len(pattern_parts) and all(fnmatch.fnmatch(p, q) for p, q in zip(parts, pattern_parts))
+
+
+def describe_file(file):
+    """(format, samples, segments) of a data file, reading only what is needed"""
+    with open(file) as f:
+        first = f.readline()
+        if first.startswith('LECROY'):
+            fields = f.readline().strip().split(',')
+            return 'lecroy', int(fields[1]) * int(fields[3]), int(fields[1])
+        n_lines = 1 + sum(1 for _ in f)
+    return 'tek', n_lines - 21, 1
+
+
+class DatasetManifest:
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_NAME)
+        self.entries = {}  # "board/waveform_type" -> {relative path: entry}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)['entries']
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: Could not read manifest {self.path}, rebuilding: {e}")
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'version': 1, 'entries': self.entries}, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Warning: Could not save manifest {self.path}: {e}")
+
+    def update(self, processor, waveform_type, pattern_parts):
+        """
+        Bring the entries matching the pattern up to date and return them as
+        (relative path, entry) sorted by path. Unparseable files are kept with channel None
+        so they are reported once, and are not returned.
+        """
+        entries = self.entries.setdefault(f"{processor.name}/{waveform_type}", {})
+        found = dict(_scan(self.root, pattern_parts))
+        changed = False
+        for rel in list(entries):
+            if rel not in found and _matches(rel, pattern_parts):
+                del entries[rel]
+                changed = True
+
+        unnumbered = []
+        for rel in sorted(found):
+            stat = found[rel]
+            old = entries.get(rel)
+            if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime_ns:
+                continue
+            file = os.path.join(self.root, rel)
+            try:
+                file_format, samples, segments = describe_file(file)
+            except (OSError, ValueError, IndexError) as e:
+                print(f"Error indexing file {file}: {e}")
+                continue
+            parsed = processor.parse_filename(file, waveform_type)
+            if parsed is None:
+                print(f"Could not extract info from {file}, skipping")
+                channel, trace_num = None, None
+            else:
+                channel, trace_num = parsed
+                if trace_num is None:
+                    if old is not None and old['channel'] == channel:
+                        trace_num = old['trace']
+                    else:
+                        unnumbered.append(rel)
+            entries[rel] = {
+                'board': processor.name,
+                'channel': channel,
+                'trace': trace_num,
+                'format': file_format,
+                'samples': samples,
+                'segments': segments,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+            }
+            changed = True
+
+        # Files without a trace number get the next free number in their channel, once
+        next_trace = {}
+        for entry in entries.values():
+            if entry['channel'] is not None and entry['trace'] is not None:
+                next_trace[entry['channel']] = max(next_trace.get(entry['channel'], 0), entry['trace'] + 1)
+        for rel in unnumbered:
+            channel = entries[rel]['channel']
+            entries[rel]['trace'] = next_trace.get(channel, 0)
+            next_trace[channel] = entries[rel]['trace'] + 1
+
+        if changed:
+            self.save()
+        return [(rel, entries[rel]) for rel in sorted(found) if rel in entries and entries[rel]['channel'] is not None]
+
+
+def count_segments(file):
+    """Number of segments in a data file, from the header of LeCroy files and 1 for Tek files"""
+    with open(file) as f:
+        if not f.readline().startswith('LECROY'):
+            return 1
+        return int(f.readline().strip().split(',')[1])
+
+
+def _first_traces(files):
+    """
+    Stored trace number of the first segment of each (file, channel, trace_num, segments):
+    the file's trace number plus the extra segments of the channel's files numbered before it,
+    so segments of sequence files of any length never share a trace number.
+    """
+    first = {}
+    extra = {}
+    for file, channel, trace_num, segments in sorted(files, key=lambda f: (f[1], f[2], f[0])):
+        first[file] = trace_num + extra.get(channel, 0)
+        extra[channel] = extra.get(channel, 0) + segments - 1
+    return [(file, channel, first[file], segments) for file, channel, trace_num, segments in files]
+
+
+def find_data_files(processor, path, waveform_type, channels=None, traces=None):
+    """
+    (file, channel, first_trace) for the files a loader should read. A glob style path goes
+    through the manifest of its directory; an explicit list of files is parsed directly,
+    numbering files without a trace number in list order. A file with N segments is stored as
+    traces first_trace ... first_trace+N-1; for single segment files first_trace is the file's
+    own trace number. channels and traces select a subset, e.g. channels=range(3, 8),
+    traces=range(50), traces being stored trace numbers: a file is selected if any of its
+    segments is, and the loaders then store only those segments.
+    """
+    if isinstance(path, str):
+        root, pattern_parts = split_pattern(path)
+        files = [(os.path.join(root, rel), entry['channel'], entry['trace'], entry['segments'])
+                 for rel, entry in DatasetManifest(root).update(processor, waveform_type, pattern_parts)]
+    else:
+        files = []
+        counters = {}
+        for file in path:
+            parsed = processor.parse_filename(file, waveform_type)
+            if parsed is None:
+                print(f"Could not extract info from {file}, skipping")
+                continue
+            channel, trace_num = parsed
+            if trace_num is None:
+                trace_num = counters.get(channel, 0)
+                counters[channel] = trace_num + 1
+            try:
+                files.append((file, channel, trace_num, count_segments(file)))
+            except (OSError, ValueError, IndexError) as e:
+                print(f"Error indexing file {file}: {e}")
+    if channels is not None:
+        channels = set(channels)
+        files = [f for f in files if f[1] in channels]
+    files = _first_traces(files)
+    if traces is not None:
+        traces = set(traces)
+        files = [f for f in files if any(f[2] + segment in traces for segment in range(f[3]))]
+    return [f[:3] for f in files]
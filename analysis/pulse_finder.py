@@ -0,0 +1,85 @@
+import numpy as np
+
+
+
+
+
+def find_pulses(time, signal, threshold, baseline_start_pct, baseline_end_pct, min_width=1, rearm_threshold=None, min_gap=5):
+    """
+    Find every pulse in a traces x samples array, not just the first threshold crossing.
+    A pulse starts when the signal goes more than threshold above the pedestal and ends when it
+    drops back below rearm_threshold (default threshold / 2), so noise on the crossing does not
+    split it. Pulses less than min_gap samples apart are merged, which keeps ringing on the tail
+    with its pulse; min_gap=0 turns that off. Pulses shorter than min_width samples are dropped.
+
+    Returns a columnar dict with one entry per pulse, ordered by trace then start sample:
+    trace (row in the input array), start_index, end_index (exclusive), peak_index,
+    peak, amplitude (peak - pedestal), t_start, width (time from start to end) and
+    charge (pedestal subtracted integral over the pulse, in time x signal units).
+    offsets has length n_traces+1 and the pulses of row i are offsets[i]:offsets[i+1].
+    """
+    signal = np.atleast_2d(signal)
+    time = np.broadcast_to(time, signal.shape)
+    n_traces, n_samples = signal.shape
+    start_idx = int(n_samples * baseline_start_pct)
+    end_idx = int(n_samples * baseline_end_pct)
+    pedestal = np.mean(signal[:, start_idx:end_idx+1], axis=1)
+    dt = np.median(np.diff(time, axis=1), axis=1)
+    if rearm_threshold is None:
+        rearm_threshold = threshold / 2
+
+    # Runs above the re-arm level, from the rising and falling edges of the mask, padded so that
+    # runs touching either end of the record are still closed. Both come out in row-major order so they pair up.
+    above = (signal - pedestal[:, None]) > min(rearm_threshold, threshold)
+    edges = np.diff(np.pad(above, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    trace, start = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+
+    # A run is a pulse if it crosses threshold, and the pulse starts at the first sample that does
+    crossings = np.append(np.flatnonzero((signal - pedestal[:, None]) > threshold), n_traces * n_samples)
+    first = crossings[np.searchsorted(crossings, trace * n_samples + start)] - trace * n_samples
+    keep = first < end
+    trace, start, end = trace[keep], first[keep], end[keep]
+
+    # Merge pulses separated by fewer than min_gap samples in the same trace
+    if len(start) > 1:
+        joins = (trace[1:] == trace[:-1]) & (start[1:] - end[:-1] < min_gap)
+        new_pulse = np.concatenate([[True], ~joins])
+        last = np.concatenate([new_pulse[1:], [True]])
+        trace, start, end = trace[new_pulse], start[new_pulse], end[last]
+
+    keep = end - start >= min_width
+    trace, start, end = trace[keep], start[keep], end[keep]
+
+    # Gather the samples of all pulses into one flat array with segment offsets, so
+    # per-pulse reductions are single reduceat calls.
+    widths = end - start
+    n_pulses = len(widths)
+    seg_offsets = np.concatenate([[0], np.cumsum(widths)[:-1]]) if n_pulses else np.zeros(0, dtype=int)
+    pulse_id = np.repeat(np.arange(n_pulses), widths)
+    sample = np.arange(widths.sum()) - np.repeat(seg_offsets, widths) + np.repeat(start, widths)
+    values = signal[trace[pulse_id], sample] - pedestal[trace[pulse_id]]
+
+    if n_pulses:
+        amplitude = np.maximum.reduceat(values, seg_offsets)
+        charge = np.add.reduceat(values, seg_offsets) * dt[trace]
+        is_peak = values == amplitude[pulse_id]
+        _, first_peak = np.unique(pulse_id[is_peak], return_index=True)
+        peak_index = sample[is_peak][first_peak]
+    else:
+        amplitude = np.zeros(0)
+        charge = np.zeros(0)
+        peak_index = np.zeros(0, dtype=int)
+
+    return {
+        'trace': trace,
+        'start_index': start,
+        'end_index': end,
+        'peak_index': peak_index,
+        'peak': amplitude + pedestal[trace],
+        'amplitude': amplitude,
+        't_start': time[trace, start],
+        'width': widths * dt[trace],
+        'charge': charge,
+        'offsets': np.searchsorted(trace, np.arange(n_traces + 1)),
+    }
@@ -0,0 +1,81 @@
+import numpy as np
+
+
+
+
+
+QUALITY_FLAGS = ['nan', 'clipped', 'saturated', 'no_pulse', 'unstable_baseline']
+
+
+def vertical_range(metadata):
+    """
+    (low, high) limits of the scope screen from a Tek header, or None if the header has no
+    vertical settings. Value = (divisions - position) * scale + offset over +-5 divisions.
+    """
+    try:
+        scale = float(metadata['Vertical Scale'])
+        offset = float(metadata.get('Vertical Offset', 0))
+        position = float(metadata.get('Vertical Position', 0))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (-5 - position) * scale + offset, (5 - position) * scale + offset
+
+
+def _longest_run(mask):
+    """Length of the longest run of True along the last axis, per row"""
+    edges = np.diff(np.pad(mask, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    longest = np.zeros(mask.shape[0], dtype=int)
+    np.maximum.at(longest, rows, ends - starts)
+    return longest
+
+
+def screen_traces(signal, baseline_start_pct, baseline_end_pct, threshold, limits=None, rail_tolerance=0.005,
+                  saturation_samples=5, baseline_rms_max=None, baseline_drift_max=None):
+    """
+    Flag bad traces in a traces x samples array. Returns a dict of boolean arrays, one per
+    QUALITY_FLAGS entry, plus 'good' for traces with no flags.
+
+    nan: samples that did not parse (NaN after to_numeric coercion)
+    clipped: samples within rail_tolerance (fraction of the range) of the screen limits,
+        limits being a (low, high) pair or per-trace arrays, see vertical_range
+    saturated: a flat top of at least saturation_samples consecutive samples at the maximum
+    no_pulse: nothing more than threshold above the pedestal
+    unstable_baseline: baseline rms above baseline_rms_max, or the two halves of the baseline
+        window differ by more than baseline_drift_max. Both default to 5x the median baseline
+        rms of the traces being screened.
+    """
+    signal = np.atleast_2d(signal)
+    n_samples = signal.shape[1]
+    flags = {}
+    flags['nan'] = np.isnan(signal).any(axis=1)
+    clean = np.where(flags['nan'][:, None], np.nan_to_num(signal), signal)
+
+    if limits is not None:
+        low, high = (np.asarray(limit, dtype=float) for limit in limits)
+        tolerance = rail_tolerance * (high - low)
+        flags['clipped'] = ((clean.max(axis=1) >= high - tolerance) | (clean.min(axis=1) <= low + tolerance))
+    else:
+        flags['clipped'] = np.zeros(len(signal), dtype=bool)
+
+    flags['saturated'] = _longest_run(clean == clean.max(axis=1, keepdims=True)) >= saturation_samples
+
+    start_idx = int(n_samples * baseline_start_pct)
+    end_idx = int(n_samples * baseline_end_pct)
+    baseline = clean[:, start_idx:end_idx+1]
+    pedestal = baseline.mean(axis=1)
+    flags['no_pulse'] = (clean.max(axis=1) - pedestal) <= threshold
+
+    half = baseline.shape[1] // 2
+    rms = baseline.std(axis=1)
+    drift = np.abs(baseline[:, :half].mean(axis=1) - baseline[:, half:].mean(axis=1)) if half else np.zeros(len(signal))
+    typical_rms = np.median(rms[~flags['nan']]) if (~flags['nan']).any() else 0
+    if typical_rms == 0:
+        typical_rms = np.inf # Perfectly flat (quantized) baselines give no scale to compare against
+    rms_max = 5 * typical_rms if baseline_rms_max is None else baseline_rms_max
+    drift_max = 5 * typical_rms if baseline_drift_max is None else baseline_drift_max
+    flags['unstable_baseline'] = (rms > rms_max) | (drift > drift_max)
+
+    flags['good'] = ~np.any([flags[flag] for flag in QUALITY_FLAGS], axis=0)
+    return flags
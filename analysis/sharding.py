@@ -0,0 +1,160 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from board_processors import PROCESSORS
+from manifest import find_data_files
+from shared_traces import RESULT_FIELDS
+
+
+
+
+
+# Campaign processing in independent shards. A shard is one board, waveform type, channel and
+# range of files; each is analysed on its own into a partial .npz, and merge_results combines
+# the partials. Traces are identified by (board, channel, file, segment) rather than load-order
+# trace numbers, and everything the merge computes is derived from the sorted per-trace table
+# or from integer histogram counts, so the merged output does not depend on how the campaign
+# was split or on the order shards finished in.
+
+STAT_FIELDS = ["output_rise_time", "output_t_low", "delay", "gain"]
+
+
+def make_shards(board, waveform_type, path, files_per_shard=50, filter_config=None, screening=None):
+    """
+    Split a dataset into shards of up to files_per_shard files of one channel. filter_config
+    holds set_filter arguments (a processor's filter_config can be passed as is) and screening
+    the screen_channel arguments (baseline_start_pct, baseline_end_pct, threshold and any
+    screen_traces options), both applied in every shard before analysis. Screening defaults
+    its baseline limits to the median of the traces screened together, which depends on the
+    shard, so give baseline_rms_max and baseline_drift_max for results independent of sharding.
+    """
+    processor = PROCESSORS[board]()
+    files_per_channel = {}
+    for file, channel, _ in find_data_files(processor, path, waveform_type):
+        files_per_channel.setdefault(channel, []).append(file)
+    shards = []
+    for channel in sorted(files_per_channel):
+        files = files_per_channel[channel]
+        for start in range(0, len(files), files_per_shard):
+            shards.append({
+                'board': board,
+                'waveform_type': waveform_type,
+                'channel': channel,
+                'file_range': (start, min(start + files_per_shard, len(files))),
+                'files': files[start:start + files_per_shard],
+                'filter_config': filter_config,
+                'screening': screening,
+            })
+    return shards
+
+
+def run_shard(shard, params, bins, output_path):
+    """
+    Load, filter, screen and analyse one shard into a partial results file. params are the
+    calculate_batch_rise_times arguments after trace_indices, bins the rise time histogram edges (ns).
+    """
+    processor = PROCESSORS[shard['board']]()
+    waveform_type = shard['waveform_type']
+    channel = shard['channel']
+    if waveform_type == 'singles':
+        processor.load_singles(shard['files'])
+    else:
+        processor.load_averages(shard['files'])
+    if shard.get('filter_config'):
+        processor.set_filter(**shard['filter_config'])
+    traces = processor.channels.get(channel, {}).get(waveform_type, {})
+    if traces and shard.get('screening'):
+        processor.screen_channel(waveform_type, channel, **shard['screening'])
+    good = processor.get_good_traces(waveform_type, channel) if traces else []
+
+    # Analyse traces of equal length together so no trace is cut to fit a batch
+    by_length = {}
+    for trace_index in good:
+        by_length.setdefault(len(traces[trace_index]['data']), []).append(trace_index)
+    for trace_indices in by_length.values():
+        try:
+            processor.calculate_batch_rise_times(waveform_type, channel, trace_indices, *params)
+        except Exception as e:
+            print(f"Error processing {processor.name} {waveform_type} channel {channel}: {e}")
+
+    trace_indices = good
+    columns = {
+        'board': np.array([shard['board']] * len(trace_indices), dtype=str),
+        'channel': np.full(len(trace_indices), channel),
+        'source_file': np.array([os.path.abspath(traces[t]['file']) for t in trace_indices], dtype=str),
+        'segment': np.array([traces[t]['metadata'].get('Segment', 0) for t in trace_indices], dtype=int),
+    }
+    for field in RESULT_FIELDS:
+        columns[field] = np.array([traces[t]['analysis'].get(field, np.nan) for t in trace_indices], dtype=float)
+    rise_times = columns['output_rise_time']
+    counts, _ = np.histogram(rise_times[np.isfinite(rise_times)], bins=bins)
+    np.savez(output_path, hist_counts=counts, bins=np.asarray(bins, dtype=float), **columns)
+    return output_path
+
+
+def merge_results(paths, output_path=None):
+    """
+    Combine partial results into one per-trace table sorted by (board, channel, source_file, segment),
+    rise time histograms per board and channel, and per-channel statistics of STAT_FIELDS.
+    Optionally saved as a single .npz.
+    """
+    parts = [dict(np.load(path)) for path in paths]
+    bins = parts[0]['bins']
+    if any(not np.array_equal(part['bins'], bins) for part in parts):
+        raise ValueError("Partial results were made with different histogram bins")
+    names = ['board', 'channel', 'source_file', 'segment'] + RESULT_FIELDS
+    traces = {name: np.concatenate([part[name] for part in parts]) for name in names}
+    order = np.lexsort((traces['segment'], traces['source_file'], traces['channel'], traces['board']))
+    traces = {name: values[order] for name, values in traces.items()}
+    trace_keys = list(zip(traces['board'].tolist(), traces['channel'].tolist(), traces['source_file'].tolist(), traces['segment'].tolist()))
+    if len(set(trace_keys)) < len(trace_keys):
+        raise ValueError("A trace appears in more than one partial result")
+
+    histograms = {}
+    for part in parts:
+        if len(part['board']):
+            key = (str(part['board'][0]), int(part['channel'][0]))
+            histograms[key] = histograms.get(key, 0) + part['hist_counts']
+
+    stats = {}
+    for board, channel in sorted({key[:2] for key in trace_keys}):
+        mask = (traces['board'] == board) & (traces['channel'] == channel)
+        channel_stats = {'n': int(mask.sum())}
+        for field in STAT_FIELDS:
+            values = traces[field][mask]
+            values = values[np.isfinite(values)]
+            channel_stats[f"{field}_mean"] = float(np.mean(values)) if len(values) else np.nan
+            channel_stats[f"{field}_std"] = float(np.std(values)) if len(values) else np.nan
+        stats[(board, channel)] = channel_stats
+
+    merged = {'traces': traces, 'bins': bins, 'histograms': histograms, 'stats': stats}
+    if output_path is not None:
+        hist_keys = sorted(histograms)
+        stat_keys = sorted(stats)
+        np.savez(output_path, bins=bins,
+                 hist_board=np.array([k[0] for k in hist_keys], dtype=str),
+                 hist_channel=np.array([k[1] for k in hist_keys], dtype=int),
+                 hist_counts=np.array([histograms[k] for k in hist_keys]).reshape(len(hist_keys), len(bins) - 1),
+                 stat_board=np.array([k[0] for k in stat_keys], dtype=str),
+                 stat_channel=np.array([k[1] for k in stat_keys], dtype=int),
+                 **{f"stat_{name}": np.array([stats[k][name] for k in stat_keys]) for name in (next(iter(stats.values())) if stats else {})},
+                 **traces)
+    return merged
+
+
+def run_campaign(shards, output_dir, params, bins, processes=1, merged_path=None):
+    """
+    Analyse every shard into output_dir/shard_NNNNN.npz, in this process when processes is 1
+    and in a process pool otherwise, then merge. The merged result is the same either way.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = [os.path.join(output_dir, f"shard_{i:05d}.npz") for i in range(len(shards))]
+    if processes == 1:
+        for shard, path in zip(shards, paths):
+            run_shard(shard, params, bins, path)
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            list(pool.map(run_shard, shards, [params] * len(shards), [bins] * len(shards), paths))
+    return merge_results(paths, merged_path)
@@ -0,0 +1,102 @@
+import os
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from timing import batch_rise_times
+
+
+
+
+
+# Everything a worker needs to map a buffer: the shared memory block name, or the path
+# of a .npy file for memory-mapped buffers. Small enough to pickle for every task.
+TraceDescriptor = namedtuple('TraceDescriptor', ['shape', 'dtype', 'shm_name', 'path'])
+
+RESULT_FIELDS = [f"{column}_{key}" for column in ("output", "input")
+                 for key in ("rise_time", "t_low", "t_high", "peak", "peak_index", "threshold_index", "pedestal")]
+RESULT_FIELDS += ["delay", "gain"]
+
+
+class SharedTraceBuffer:
+    """
+    numpy array living in POSIX shared memory, or in a memory-mapped .npy file when a path is given,
+    that other processes can attach to from its descriptor without copying.
+    The creating process is responsible for unlink().
+    """
+    def __init__(self, descriptor, array, shm=None):
+        self.descriptor = descriptor
+        self.array = array
+        self._shm = shm
+
+    @classmethod
+    def create(cls, shape, dtype=np.float64, path=None):
+        shape = tuple(int(n) for n in shape)
+        dtype = np.dtype(dtype).str
+        if path is not None:
+            array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+            return cls(TraceDescriptor(shape, dtype, None, path), array)
+        nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        return cls(TraceDescriptor(shape, dtype, shm.name, None), array, shm)
+
+    @classmethod
+    def from_array(cls, data, path=None):
+        buffer = cls.create(data.shape, data.dtype, path)
+        buffer.array[...] = data
+        return buffer
+
+    @classmethod
+    def attach(cls, descriptor):
+        if descriptor.path is not None:
+            return cls(descriptor, np.load(descriptor.path, mmap_mode='r+'))
+        try:
+            shm = shared_memory.SharedMemory(name=descriptor.shm_name, track=False)
+        except TypeError:
+            # Before python 3.13 attaching always registers with the resource tracker. Pool
+            # workers share the creating process's tracker, so this is a harmless duplicate.
+            shm = shared_memory.SharedMemory(name=descriptor.shm_name)
+        return cls(descriptor, np.ndarray(descriptor.shape, dtype=descriptor.dtype, buffer=shm.buf), shm)
+
+    def close(self):
+        if isinstance(self.array, np.memmap):
+            self.array.flush()
+        self.array = None
+        if self._shm is not None:
+            self._shm.close()
+
+    def unlink(self):
+        self.close()
+        if self.descriptor.path is not None:
+            os.remove(self.descriptor.path)
+        elif self._shm is not None:
+            self._shm.unlink()
+
+
+def analyse_slice(traces_descriptor, results_descriptor, columns, start, stop, params):
+    """
+    Worker task: rise times, delay and gain for traces start:stop of a shared
+    (column x trace x sample) buffer, written into rows start:stop of the shared results buffer.
+    params are the batch_rise_times arguments after time and signal.
+    """
+    traces = SharedTraceBuffer.attach(traces_descriptor)
+    results = SharedTraceBuffer.attach(results_descriptor)
+    try:
+        time = traces.array[columns.index("time"), start:stop] * 1e9 # Convert to ns
+        out = results.array
+        for column in ("output", "input"):
+            if column in columns:
+                signal = traces.array[columns.index(column), start:stop] * 1e3 # Convert to mV
+                for key, values in batch_rise_times(time, signal, *params).items():
+                    out[start:stop, RESULT_FIELDS.index(f"{column}_{key}")] = values
+        if "input" in columns:
+            field = RESULT_FIELDS.index
+            out[start:stop, field("delay")] = out[start:stop, field("output_t_low")] - out[start:stop, field("input_t_low")]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[start:stop, field("gain")] = ((out[start:stop, field("output_peak")] - out[start:stop, field("output_pedestal")])
+                                                  / (out[start:stop, field("input_peak")] - out[start:stop, field("input_pedestal")]))
+    finally:
+        traces.close()
+        results.close()
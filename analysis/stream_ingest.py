@@ -0,0 +1,119 @@
+import asyncio
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+
+
+
+
+
+# A frame is a fixed prefix (magic, header length, payload length), a JSON header and the samples.
+# The header carries the same fields as the Tek/LeCroy file headers ("Model", "Sample Interval",
+# "Record Length", "Vertical Scale", ...) plus channel, trace, columns and dtype. The payload
+# is a columns x samples array, time included, in the header dtype.
+FRAME_MAGIC = b'WFM1'
+FRAME_PREFIX = struct.Struct('>4sII')
+FRAME_FIELDS = ('channel', 'trace', 'columns', 'dtype', 'shape')  # Header fields that are not trace metadata
+
+
+def encode_frame(header, data):
+    data = np.ascontiguousarray(data, dtype=header.get('dtype', '<f8'))
+    header = dict(header, dtype=data.dtype.str, shape=list(data.shape))
+    header_bytes = json.dumps(header).encode()
+    payload = data.tobytes()
+    return FRAME_PREFIX.pack(FRAME_MAGIC, len(header_bytes), len(payload)) + header_bytes + payload
+
+
+async def read_frame(reader):
+    """Read one frame, returns (header, data) or None when the stream closes between frames"""
+    try:
+        prefix = await reader.readexactly(FRAME_PREFIX.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    magic, header_len, payload_len = FRAME_PREFIX.unpack(prefix)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"Bad frame magic {magic!r}")
+    header = json.loads(await reader.readexactly(header_len))
+    payload = await reader.readexactly(payload_len)
+    data = np.frombuffer(payload, dtype=header['dtype']).reshape(header['shape'])
+    return header, data
+
+
+def decode_frame(header, data):
+    """DataFrame in the layout the loaders produce, columns named as in the header"""
+    return pd.DataFrame({column: data[i] for i, column in enumerate(header['columns'])})
+
+
+async def ingest(processor, host, port, waveform_type='singles', batch_size=32, queue_size=64, analysis_params=None, on_batch=None):
+    """
+    Stream framed waveforms from a scope or DAQ into a processor.
+
+    Frames are read into a bounded queue; when analysis falls behind, the queue fills, the
+    reader stops reading and TCP flow control holds back the sender. Decoded traces are stored
+    with add_trace, the rest of the frame header becoming their metadata, and every batch_size
+    traces analysed per channel with calculate_batch_rise_times (analysis_params are its
+    arguments after trace_indices) in a worker thread so reading carries on.
+    on_batch(processor, {channel: [trace_indices]}) is called after each batch.
+    Returns the number of traces received per channel.
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    reader, writer = await asyncio.open_connection(host, port)
+    loop = asyncio.get_running_loop()
+    received = {}
+
+    async def receive():
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                await queue.put(frame)
+        finally:
+            await queue.put(None)
+
+    def analyse(batch):
+        for channel, trace_indices in batch.items():
+            if analysis_params is not None:
+                try:
+                    processor.calculate_batch_rise_times(waveform_type, channel, trace_indices, *analysis_params)
+                except Exception as e:
+                    print(f"Error processing {processor.name} {waveform_type} channel {channel}: {e}")
+        if on_batch is not None:
+            on_batch(processor, batch)
+
+    async def consume():
+        batch = {}
+        n_batch = 0
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                break
+            header, data = frame
+            channel = int(header['channel'])
+            trace_num = int(header['trace'])
+            metadata = {key: value for key, value in header.items() if key not in FRAME_FIELDS}
+            processor.add_trace(channel, waveform_type, trace_num, decode_frame(header, data), metadata=metadata)
+            batch.setdefault(channel, []).append(trace_num)
+            received[channel] = received.get(channel, 0) + 1
+            n_batch += 1
+            if n_batch >= batch_size:
+                await loop.run_in_executor(None, analyse, batch)
+                batch = {}
+                n_batch = 0
+        if batch:
+            await loop.run_in_executor(None, analyse, batch)
+
+    tasks = [asyncio.ensure_future(receive()), asyncio.ensure_future(consume())]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        writer.close()
+        await writer.wait_closed()
+    print(f"Received {sum(received.values())} {waveform_type} traces across {len(received)} channels for {processor.name}")
+    return received
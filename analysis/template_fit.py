@@ -0,0 +1,121 @@
+import numpy as np
+
+
+
+
+
+# Template fit timing: every trace of a channel is compared with the channel's averaged
+# waveform, s(t) ~ a * template(t - shift), by FFT cross-correlation over all lags and all
+# traces at once. The best lag maximises c^2 / E (c the correlation, E the template energy
+# overlapping the trace), which is the least squares fit, and is refined to a fraction of a
+# sample with a parabola through the correlation around it.
+
+
+def reference_time(time, template, fraction=0.2):
+    """Time at which a pedestal subtracted template first reaches fraction of its peak before the peak, interpolated"""
+    peak = int(np.argmax(template))
+    level = fraction * template[peak]
+    below = np.nonzero(template[:peak+1] < level)[0]
+    if len(below) == 0:
+        return time[peak]
+    i = below[-1]
+    return time[i] + (level - template[i]) / (template[i+1] - template[i]) * (time[i+1] - time[i])
+
+
+def fit_template(time, signal, template_time, template, baseline_start_pct, baseline_end_pct, fraction=0.2,
+                 max_shift=None, min_overlap=0.5, window=None, min_correlation=None, max_chi2=None):
+    """
+    Fit a template to every trace of a traces x samples array. time is per trace or shared,
+    template_time and template are 1-D and are resampled to the traces' sample spacing.
+    Both are pedestal subtracted using the baseline window.
+
+    Returns a dict of per-trace arrays:
+    time: when the fitted pulse reaches fraction of its peak, in the traces' time frame
+    amplitude: peak height of the fitted template (template units scaled by the fit)
+    shift: offset of the fitted template in samples
+    correlation: normalised correlation of trace and fitted template, 1 for a perfect match
+    chi2: residual mean square over the baseline variance, about 1 for a good fit
+    pedestal: baseline mean of the trace
+    Fits are restricted to shifts up to max_shift (time units) from the template's own position
+    if given, and to lags where at least min_overlap of the template energy lies inside the trace.
+    window = (before, after) cuts the template to the pulse, from before ahead of its fraction
+    crossing to after past its peak, so a tail that does not return to baseline is not fitted.
+    Traces with no positive match get nan, and so do the time, amplitude and shift of fits with
+    correlation below min_correlation or chi2 above max_chi2.
+    """
+    signal = np.atleast_2d(np.asarray(signal, dtype=float))
+    time = np.broadcast_to(time, signal.shape)
+    template_time = np.asarray(template_time, dtype=float)
+    n_traces, n_samples = signal.shape
+    dt = np.median(np.diff(time[0]))
+
+    grid = np.arange(template_time[0], template_time[-1] + dt / 2, dt)
+    template = np.interp(grid, template_time, template)
+    n_template = len(template)
+    template = template - template[int(n_template * baseline_start_pct):int(n_template * baseline_end_pct)+1].mean()
+    if window is not None:
+        before, after = window
+        cut = (grid >= reference_time(grid, template, fraction) - before) & (grid <= grid[np.argmax(template)] + after)
+        grid, template = grid[cut], template[cut]
+        n_template = len(template)
+
+    start_idx = int(n_samples * baseline_start_pct)
+    end_idx = int(n_samples * baseline_end_pct)
+    baseline = signal[:, start_idx:end_idx+1]
+    pedestal = baseline.mean(axis=1)
+    noise = baseline.var(axis=1)
+    signal = signal - pedestal[:, None]
+
+    # c[k] = sum_j s[j+k] t[j] for every lag k from -(n_template-1) to n_samples-1
+    size = 1 << int(np.ceil(np.log2(n_samples + n_template - 1)))
+    corr = np.fft.irfft(np.fft.rfft(signal, size, axis=1) * np.conj(np.fft.rfft(template, size)), size, axis=1)
+    lags = np.arange(-(n_template - 1), n_samples)
+    corr = corr[:, lags % size]
+
+    cumulative = np.concatenate([[0], np.cumsum(template**2)])
+    energy = cumulative[np.clip(n_samples - lags, 0, n_template)] - cumulative[np.clip(-lags, 0, n_template)]
+    allowed = np.broadcast_to(energy >= min_overlap * cumulative[-1], corr.shape)
+    if max_shift is not None:
+        offset = (time[:, :1] - grid[0]) + lags * dt
+        allowed = allowed & (np.abs(offset) <= max_shift)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(allowed & (corr > 0), corr**2 / energy, -np.inf)
+    rows = np.arange(n_traces)
+    best = np.argmax(score, axis=1)
+    found = np.isfinite(score[rows, best])
+
+    left = corr[rows, np.maximum(best - 1, 0)]
+    centre = corr[rows, best]
+    right = corr[rows, np.minimum(best + 1, len(lags) - 1)]
+    curvature = left - 2 * centre + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0)
+    delta = np.clip(delta, -0.5, 0.5)
+    peak_corr = centre - 0.25 * (left - right) * delta
+    best_energy = energy[best]
+    shift = lags[best] + delta
+
+    total = np.sum(signal**2, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = peak_corr / best_energy
+        correlation = peak_corr / np.sqrt(best_energy * total)
+        chi2 = np.maximum(total - peak_corr**2 / best_energy, 0) / (n_samples - 2) / noise
+
+    results = {
+        'time': reference_time(grid, template, fraction) + (time[:, 0] - grid[0]) + shift * dt,
+        'amplitude': scale * template.max(),
+        'shift': shift,
+        'correlation': correlation,
+        'chi2': chi2,
+    }
+    for key in results:
+        results[key] = np.where(found, results[key], np.nan)
+    rejected = np.zeros(n_traces, dtype=bool)
+    if min_correlation is not None:
+        rejected |= ~(results['correlation'] >= min_correlation)
+    if max_chi2 is not None:
+        rejected |= ~(results['chi2'] <= max_chi2)
+    for key in ('time', 'amplitude', 'shift'):
+        results[key] = np.where(rejected, np.nan, results[key])
+    results['pedestal'] = pedestal
+    return results
@@ -0,0 +1,31 @@
+import glob
+import os
+import shutil
+import sys
+
+import pytest
+
+# The analysis modules import each other by name, as when run from analysis/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data")
+
+
+@pytest.fixture
+def data_copy(tmp_path):
+    """
+    copy(pattern, per_directory=None) copies the files under data/ matching pattern into
+    tmp_path, keeping their directories (CASB2 reads channels from them), and returns the
+    pattern rooted there. Tests then never write manifests or touch files in the checked-in data.
+    """
+    def copy(pattern, per_directory=None):
+        by_directory = {}
+        for file in sorted(glob.glob(os.path.join(DATA, pattern))):
+            by_directory.setdefault(os.path.dirname(file), []).append(file)
+        for files in by_directory.values():
+            for file in files[:per_directory]:
+                target = tmp_path / "data" / os.path.relpath(file, DATA)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(file, target)
+        return str(tmp_path / "data" / pattern)
+    return copy
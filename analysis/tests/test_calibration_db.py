@@ -0,0 +1,53 @@
+import os
+
+from board_processors import CASB2Processor
+from calibration_db import CalibrationDB
+
+PARAMS = (0, 0.1, 5, 0.1, 0.9, False)
+
+
+def _processor(path, channels=None):
+    processor = CASB2Processor()
+    processor.load_singles(path, channels=channels)
+    return processor
+
+
+def test_incremental_update(tmp_path, data_copy):
+    path = data_copy("casb2/2nhit/singles/ch*/tek*ALL.csv", per_directory=3)
+    db = CalibrationDB(str(tmp_path / "calibration.db"))
+    processor = _processor(path)
+    channels = sorted(processor.channels)
+    assert processor.update_calibration_db(db, 'singles', 'run1', *PARAMS) == channels
+    # Nothing changed: every channel is skipped and the constants stay
+    table = db.get_table('CASB2', 'delay')
+    assert sorted(table) == channels
+    assert processor.update_calibration_db(db, 'singles', 'run1', *PARAMS) == []
+    assert db.get_table('CASB2', 'delay') == table
+
+    # A rewritten input file re-runs only its channel
+    file = processor.channels[channels[1]]['singles'][1]['file']
+    st = os.stat(file)
+    os.utime(file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert processor.update_calibration_db(db, 'singles', 'run1', *PARAMS) == [channels[1]]
+
+    # New parameters are a new parameter set, so everything re-runs
+    assert processor.update_calibration_db(db, 'singles', 'run1', 0, 0.1, 6, 0.1, 0.9, False) == channels
+    db.close()
+
+
+def test_table_from_one_run(tmp_path, data_copy):
+    path = data_copy("casb2/2nhit/singles/ch*/tek*ALL.csv", per_directory=3)
+    db = CalibrationDB(str(tmp_path / "calibration.db"))
+    processor = _processor(path)
+    channels = sorted(processor.channels)
+    processor.update_calibration_db(db, 'singles', 'run1', *PARAMS)
+    full = db.get_table('CASB2', 't_low')
+
+    # A later run of one channel only: the table is that run, not run1 filling in the other channels
+    _processor(path, channels=channels[:1]).update_calibration_db(db, 'singles', 'run2', 0, 0.1, 6, 0.1, 0.9, False)
+    assert sorted(db.get_table('CASB2', 't_low')) == channels[:1]
+    assert db.get_table('CASB2', 't_low', dataset='run1') == full
+    param_set = db.latest_run('CASB2', dataset='run1')[1]
+    assert db.get_table('CASB2', 't_low', param_set=param_set) == full
+    assert db.get_table('CASB1', 't_low') == {}
+    db.close()
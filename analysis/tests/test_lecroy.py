@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from board_processors import CASB1Processor, read_lecroy
+
+
+def write_sequence(path, n_segments, segment_size, first_value=0):
+    """LeCroy sequence export whose samples encode (segment, sample) so misplaced values show"""
+    time = np.arange(segment_size) * 1e-10
+    amplitude = first_value + np.arange(n_segments)[:, None] + np.arange(segment_size) * 1e-4
+    with open(path, 'w') as f:
+        f.write(f"LECROYWaveRunner,41075,Waveform\nSegments,{n_segments},SegmentSize,{segment_size}\n")
+        f.write("Segment,TrigTime,TimeSinceSegment1\n")
+        for segment in range(n_segments):
+            f.write(f"#{segment + 1},12-Nov-2024 18:46:{segment:02d},{segment * 1e-3}\n")
+        f.write("Time,Ampl\n")
+        for segment in range(n_segments):
+            for t, a in zip(time, amplitude[segment]):
+                f.write(f"{t},{a}\n")
+    return time, amplitude
+
+
+@pytest.mark.parametrize("chunk_segments", [1, 2, 3, 256])
+def test_read_sequence(tmp_path, chunk_segments):
+    expected_time, expected = write_sequence(tmp_path / "C1--Trace--00000.txt", 5, 40)
+    time, amplitude, metadata = read_lecroy(tmp_path / "C1--Trace--00000.txt", chunk_segments=chunk_segments)
+    assert amplitude.shape == (5, 40)
+    assert time.shape == (5, 40)
+    np.testing.assert_allclose(amplitude, expected)
+    np.testing.assert_allclose(time, np.broadcast_to(expected_time, (5, 40)))
+    assert metadata['Segments'] == 5
+    assert metadata['SegmentSize'] == 40
+    assert metadata['TrigTime'] == [f"12-Nov-2024 18:46:{s:02d}" for s in range(5)]
+    np.testing.assert_allclose(metadata['TimeSinceSegment1'], np.arange(5) * 1e-3)
+
+
+def test_sequence_trace_numbers(tmp_path):
+    write_sequence(tmp_path / "C1--Trace--00000.txt", 5, 20, first_value=0)
+    write_sequence(tmp_path / "C1--Trace--00001.txt", 2, 20, first_value=100)
+    write_sequence(tmp_path / "C1--Trace--00002.txt", 1, 20, first_value=200)
+    write_sequence(tmp_path / "C1--Trace--00003.txt", 3, 20, first_value=300)
+    processor = CASB1Processor()
+    processor.load_singles(str(tmp_path / "C1--Trace--*.txt"))
+    traces = processor.channels[1]['singles']
+    assert sorted(traces) == list(range(11))
+    # Every segment of every file is kept, in file then segment order
+    first_values = [traces[t]['data']['output'].values[0] for t in sorted(traces)]
+    assert first_values == [0, 1, 2, 3, 4, 100, 101, 200, 300, 301, 302]
+    assert [traces[t]['metadata']['Segment'] for t in sorted(traces)] == [0, 1, 2, 3, 4, 0, 1, 0, 0, 1, 2]
+
+    selected = CASB1Processor()
+    selected.load_singles(str(tmp_path / "C1--Trace--*.txt"), traces=[4, 5, 7])
+    assert sorted(selected.channels[1]['singles']) == [4, 5, 7]
+    assert selected.channels[1]['singles'][7]['data']['output'].values[0] == 200
@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+
+import manifest
+from board_processors import CASB1Processor, CASB2Processor
+from manifest import MANIFEST_NAME, DatasetManifest, find_data_files, split_pattern
+
+
+def _traces(processor, path, waveform_type):
+    root, _ = split_pattern(path)
+    return {os.path.relpath(file, root): (channel, trace) for file, channel, trace in find_data_files(processor, path, waveform_type)}
+
+
+def test_unnumbered_files_keep_their_trace(data_copy):
+    path = data_copy("casb1/averages/new/ch*.csv")
+    root, _ = split_pattern(path)
+    processor = CASB1Processor()
+    first = _traces(processor, path, 'averages')
+    assert len(first) == 20
+    assert first['ch1.csv'] == (1, 0)
+    assert os.path.exists(os.path.join(root, MANIFEST_NAME))
+    assert _traces(processor, path, 'averages') == first
+
+    # A new file sorting before ch1.csv gets the next free number instead of taking ch1.csv's
+    shutil.copy2(os.path.join(root, "ch2.csv"), os.path.join(root, "ch1-0.csv"))
+    second = _traces(processor, path, 'averages')
+    assert second['ch1.csv'] == (1, 0)
+    assert second['ch1-0.csv'] == (1, 1)
+    assert {f: t for f, t in second.items() if f != 'ch1-0.csv'} == first
+    processor.load_averages(path)
+    assert sorted(processor.channels[1]['averages']) == [0, 1]
+    assert processor.channels[1]['averages'][0]['file'].endswith("ch1.csv")
+
+
+def test_changed_and_deleted_files(data_copy, monkeypatch):
+    path = data_copy("casb2/2nhit/singles/ch*/tek*ALL.csv", per_directory=3)
+    root, _ = split_pattern(path)
+    processor = CASB2Processor()
+    before = _traces(processor, path, 'singles')
+
+    described = []
+    describe_file = manifest.describe_file
+    monkeypatch.setattr(manifest, 'describe_file', lambda file: described.append(os.path.relpath(file, root)) or describe_file(file))
+    _traces(processor, path, 'singles')
+    assert described == []
+
+    # Same size with a new mtime, and a new size, are both read again
+    touched = os.path.join(root, "ch1", "tek0001ALL.csv")
+    st = os.stat(touched)
+    os.utime(touched, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    truncated = os.path.join(root, "ch13", "tek0002ALL.csv")
+    with open(truncated) as f:
+        lines = f.readlines()
+    with open(truncated, 'w') as f:
+        f.writelines(lines[:-100])
+    os.remove(os.path.join(root, "ch7", "tek0000ALL.csv"))
+    _traces(processor, path, 'singles')
+    assert sorted(described) == ["ch1/tek0001ALL.csv", "ch13/tek0002ALL.csv"]
+
+    with open(os.path.join(root, MANIFEST_NAME)) as f:
+        entries = json.load(f)['entries']['CASB2/singles']
+    assert entries["ch1/tek0001ALL.csv"]['mtime'] == st.st_mtime_ns + 10**9
+    assert entries["ch13/tek0002ALL.csv"]['samples'] == len(lines) - 100 - 21
+    assert "ch7/tek0000ALL.csv" not in entries
+    assert len(entries) == len(before) - 1
+    # The manifest on disk is read back, not rebuilt
+    assert DatasetManifest(root).entries['CASB2/singles'] == entries
+
+
+def test_channel_and_trace_selection(data_copy):
+    path = data_copy("casb2/2nhit/singles/ch*/tek*ALL.csv", per_directory=5)
+    processor = CASB2Processor()
+    files = find_data_files(processor, path, 'singles', channels=[1, 13], traces=range(2))
+    assert sorted((channel, trace) for _, channel, trace in files) == [(1, 0), (1, 1), (13, 0), (13, 1)]
+    processor.load_singles(path, channels=[13], traces=[3, 4])
+    assert sorted(processor.channels) == [13]
+    assert sorted(processor.channels[13]['singles']) == [3, 4]
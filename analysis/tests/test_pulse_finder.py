@@ -0,0 +1,54 @@
+import numpy as np
+
+from pulse_finder import find_pulses
+
+TIME = np.arange(200) * 0.4
+
+
+def _pulse(center, amplitude, sigma=2.0):
+    return amplitude * np.exp(-0.5 * ((np.arange(200) - center) / sigma) ** 2)
+
+
+def test_two_separated_pulses():
+    signal = np.stack([_pulse(60, 50) + _pulse(140, 30), np.zeros(200)])
+    pulses = find_pulses(TIME, signal, 10, 0, 0.1)
+    np.testing.assert_array_equal(pulses['trace'], [0, 0])
+    np.testing.assert_array_equal(pulses['peak_index'], [60, 140])
+    np.testing.assert_allclose(pulses['amplitude'], [50, 30])
+    np.testing.assert_array_equal(pulses['offsets'], [0, 2, 2])
+    # Each pulse runs from its threshold crossing to where it falls below half of it
+    assert TIME[pulses['start_index'][0] - 1] < pulses['t_start'][0] <= TIME[60]
+    assert np.all(signal[0, pulses['start_index']] > 10)
+    assert np.all(signal[0, pulses['end_index']] <= 5)
+    expected = [signal[0, s:e].sum() * 0.4 for s, e in zip(pulses['start_index'], pulses['end_index'])]
+    np.testing.assert_allclose(pulses['charge'], expected)
+
+
+def test_pulse_touching_record_edges():
+    signal = _pulse(0, 40) + _pulse(199, 40)
+    pulses = find_pulses(TIME, signal, 10, 0.3, 0.6)
+    assert pulses['start_index'][0] == 0
+    assert pulses['end_index'][1] == 200
+    np.testing.assert_array_equal(pulses['peak_index'], [0, 199])
+
+
+def test_no_pulses():
+    rng = np.random.default_rng(0)
+    pulses = find_pulses(TIME, rng.normal(0, 1, (3, 200)), 10, 0, 0.1)
+    assert len(pulses['trace']) == 0
+    assert len(pulses['charge']) == 0
+    np.testing.assert_array_equal(pulses['offsets'], [0, 0, 0, 0])
+
+
+def test_noise_does_not_split_a_pulse():
+    # Flat top dipping just under threshold, then a small ring 3 samples after the tail
+    signal = np.zeros(200)
+    signal[50:90] = 40
+    signal[70] = 8
+    signal[90:93] = 2
+    signal[93:96] = 12
+    pulses = find_pulses(TIME, signal, 10, 0, 0.1)
+    np.testing.assert_array_equal(pulses['start_index'], [50])
+    np.testing.assert_array_equal(pulses['end_index'], [96])
+    split = find_pulses(TIME, signal, 10, 0, 0.1, rearm_threshold=10, min_gap=0)
+    np.testing.assert_array_equal(split['start_index'], [50, 71, 93])
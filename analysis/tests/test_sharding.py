@@ -0,0 +1,43 @@
+import numpy as np
+
+from board_processors import CASB2Processor
+from sharding import make_shards, run_campaign
+
+PARAMS = (0, 0.1, 5, 0.1, 0.9, False)
+BINS = np.linspace(0, 10, 41)
+FILTER = {'fir': 3, 'blr_tau': 200}
+SCREENING = {'baseline_start_pct': 0, 'baseline_end_pct': 0.1, 'threshold': 50,
+             'baseline_rms_max': 5, 'baseline_drift_max': 5}
+
+
+def _load(path):
+    with np.load(path) as merged:
+        return {name: merged[name] for name in merged.files}
+
+
+def test_campaign_independent_of_sharding(tmp_path, data_copy):
+    # A copy, as sharding writes the manifest next to the data
+    data = data_copy("casb2/2nhit/singles/ch*/tek*ALL.csv")
+    shards = make_shards('CASB2', 'singles', data, files_per_shard=10, filter_config=FILTER, screening=SCREENING)
+    run_campaign(shards, tmp_path / "one", PARAMS, BINS, processes=1, merged_path=tmp_path / "one.npz")
+    shards = make_shards('CASB2', 'singles', data, files_per_shard=3, filter_config=FILTER, screening=SCREENING)
+    run_campaign(shards[::-1], tmp_path / "four", PARAMS, BINS, processes=4, merged_path=tmp_path / "four.npz")
+
+    one = _load(tmp_path / "one.npz")
+    four = _load(tmp_path / "four.npz")
+    assert sorted(one) == sorted(four)
+    for name in one:
+        np.testing.assert_array_equal(one[name], four[name], err_msg=name)
+
+    # Same traces and results as screening and filtering the whole dataset in one processor
+    processor = CASB2Processor()
+    processor.load_singles(data)
+    processor.set_filter(**FILTER)
+    expected = []
+    for channel in sorted(processor.channels):
+        processor.screen_channel('singles', channel, **SCREENING)
+        good = processor.get_good_traces('singles', channel)
+        processor.calculate_batch_rise_times('singles', channel, good, *PARAMS)
+        expected.extend(processor.get_analysis_array('singles', channel, 'output_rise_time'))
+    assert 0 < len(one['output_rise_time']) < 88
+    np.testing.assert_allclose(np.sort(one['output_rise_time']), np.sort(expected))
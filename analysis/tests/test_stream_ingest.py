@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import numpy as np
+
+from fake_scope import FakeScopeServer, synthetic_frames
+from quality import vertical_range
+from stream_ingest import ingest
+from waveform_processor import WaveformProcessor
+
+PARAMS = (0, 0.05, 5, 0.1, 0.9, False)
+
+
+def test_ingest_fake_scope():
+    frames = synthetic_frames(20, channels=(1, 2))
+    processor = WaveformProcessor("stream")
+
+    async def run():
+        async with FakeScopeServer(frames) as scope:
+            return await ingest(processor, scope.host, scope.port, batch_size=8, analysis_params=PARAMS)
+
+    received = asyncio.run(run())
+    assert received == {1: 20, 2: 20}
+    for channel in (1, 2):
+        assert sorted(processor.channels[channel]['singles']) == list(range(20))
+        delays = processor.get_analysis_array('singles', channel, 'delay')
+        assert np.isfinite(delays).all()
+        assert abs(np.mean(delays) - 30) < 1 # synthetic_frames delays the output by 30 ns
+        trace = processor.channels[channel]['singles'][0]
+        assert trace['metadata']['Vertical Scale'] == 0.02
+        assert 'channel' not in trace['metadata']
+        assert vertical_range(trace['metadata']) is not None # so screening checks for clipping
+    summary = processor.screen_channel('singles', 1, 0, 0.05, 5)
+    assert summary['good'] == 20
+
+
+def test_ingest_backpressure():
+    # 10000 samples x 3 columns is 240 kB a frame, so 200 frames cannot sit in socket buffers
+    frames = synthetic_frames(200, n_samples=10000)
+    processor = WaveformProcessor("stream")
+    scope = FakeScopeServer(frames)
+    sent_during_first_batch = []
+
+    def slow_batch(processor, batch):
+        if not sent_during_first_batch:
+            time.sleep(0.5)
+            sent_during_first_batch.append(scope.frames_sent)
+
+    async def run():
+        async with scope:
+            return await ingest(processor, scope.host, scope.port, batch_size=4, queue_size=4, on_batch=slow_batch)
+
+    received = asyncio.run(run())
+    assert received == {1: 200}
+    assert len(processor.channels[1]['singles']) == 200
+    # While the first batch was being handled the server was held back, not done sending
+    assert sent_during_first_batch[0] < len(frames)
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from calibration_db import CalibrationDB
+from time_walk import TimeWalkCorrection, collect_timing, corrected_delay_table
+from waveform_processor import WaveformProcessor
+
+# Both boards have channels 1 and 2, with different walk: delay = c0 + c1/sqrt(amplitude)
+WALK = {('A', 1): (20.0, 40.0), ('A', 2): (25.0, 10.0), ('B', 1): (30.0, 80.0), ('B', 2): (22.0, 0.0)}
+
+
+def _board(name, rng, n_traces=200):
+    processor = WaveformProcessor(name)
+    df = pd.DataFrame({"time": np.zeros(1), "output": np.zeros(1)})
+    for channel in (1, 2):
+        c0, c1 = WALK[(name, channel)]
+        for trace in range(n_traces):
+            amplitude = rng.uniform(20, 500)
+            processor.add_trace(channel, 'singles', trace, df)
+            processor.channels[channel]['singles'][trace]['analysis'] = {
+                'output_peak': amplitude + 3, 'output_pedestal': 3,
+                'delay': c0 + c1 / np.sqrt(amplitude) + rng.normal(0, 0.01),
+            }
+    return processor
+
+
+def test_recovers_walk_per_board(tmp_path):
+    rng = np.random.default_rng(1)
+    datasets = [(_board('A', rng), 'singles'), (_board('B', rng), 'singles')]
+    boards, channels, amplitudes, times = collect_timing(datasets)
+    assert len(times) == 800
+    correction = TimeWalkCorrection(degree=1, reference_amplitude=100).fit(boards, channels, amplitudes, times)
+    assert sorted(correction.coefficients) == sorted(WALK)
+    for key, expected in WALK.items():
+        np.testing.assert_allclose(correction.coefficients[key], expected, atol=0.05, err_msg=str(key))
+
+    # Corrected to a 100 mV pulse, every trace of a channel has the same delay
+    table = corrected_delay_table(datasets, correction)
+    for key, (c0, c1) in WALK.items():
+        assert abs(table[key] - (c0 + c1 / 10)) < 0.01
+
+    loaded = TimeWalkCorrection.from_dict(correction.to_dict())
+    assert loaded.coefficients == correction.coefficients
+
+    db = CalibrationDB(str(tmp_path / "calibration.db"))
+    correction.store(db, 'walk')
+    for board in ('A', 'B'):
+        assert db.get_table(board, 'walk_c1') == {ch: correction.coefficients[(board, ch)][1] for ch in (1, 2)}
+    db.close()
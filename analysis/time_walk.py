@@ -0,0 +1,147 @@
+import json
+
+import numpy as np
+
+
+
+
+
+class TimeWalkCorrection:
+    """
+    Per-channel time walk curves: timing as a polynomial in 1/sqrt(amplitude),
+    t = c0 + c1/sqrt(A) + c2/A + ..., fitted for all channels at once. Channels are
+    identified by (board, channel), as boards reuse channel numbers.
+    Corrections are relative to reference_amplitude, so corrected times are the times
+    a pulse of that amplitude would have had. Amplitudes in mV and times in ns, as in the analysis dicts.
+    """
+    def __init__(self, degree=1, reference_amplitude=None):
+        self.degree = degree
+        self.reference_amplitude = reference_amplitude
+        self.coefficients = {}  # (board, channel) -> [c0, c1, ...]
+
+    def _design(self, amplitudes):
+        x = 1 / np.sqrt(np.asarray(amplitudes, dtype=float))
+        return x[:, None] ** np.arange(self.degree + 1)
+
+    def fit(self, boards, channels, amplitudes, times):
+        """Least squares fit of every channel in one pass, from flat per-trace arrays"""
+        boards = np.asarray(boards)
+        channels = np.asarray(channels)
+        amplitudes = np.asarray(amplitudes, dtype=float)
+        times = np.asarray(times, dtype=float)
+        keep = np.isfinite(amplitudes) & np.isfinite(times) & (amplitudes > 0)
+        boards, channels, amplitudes, times = boards[keep], channels[keep], amplitudes[keep], times[keep]
+        if self.reference_amplitude is None:
+            self.reference_amplitude = float(np.median(amplitudes))
+        unique_channels, index = _channel_index(boards, channels)
+        X = self._design(amplitudes)
+        n_terms = X.shape[1]
+        # Per-channel normal equations accumulated with np.add.at and solved as one batch
+        XtX = np.zeros((len(unique_channels), n_terms, n_terms))
+        Xty = np.zeros((len(unique_channels), n_terms))
+        np.add.at(XtX, index, X[:, :, None] * X[:, None, :])
+        np.add.at(Xty, index, X * times[:, None])
+        counts = np.bincount(index, minlength=len(unique_channels))
+        solvable = (counts >= n_terms) & (np.linalg.matrix_rank(XtX) == n_terms)
+        coefficients = np.full((len(unique_channels), n_terms), np.nan)
+        if solvable.any():
+            coefficients[solvable] = np.linalg.solve(XtX[solvable], Xty[solvable][..., None])[..., 0]
+        for (board, channel), coeffs, ok in zip(unique_channels, coefficients, solvable):
+            if ok:
+                self.coefficients[(board, channel)] = coeffs.tolist()
+            else:
+                print(f"Not enough amplitude spread to fit time walk for {board} channel {channel}")
+        return self
+
+    def walk(self, boards, channels, amplitudes):
+        """Timing shift of each pulse relative to a reference amplitude pulse, nan for unfitted channels"""
+        unfitted = [np.nan] * (self.degree + 1)
+        keys = zip(np.asarray(boards).tolist(), np.asarray(channels).tolist())
+        coefficients = np.array([self.coefficients.get(key, unfitted) for key in keys]).reshape(-1, self.degree + 1)
+        shift = self._design(amplitudes) - self._design([self.reference_amplitude])
+        return np.sum(coefficients * shift, axis=1)
+
+    def apply(self, boards, channels, amplitudes, times):
+        return np.asarray(times, dtype=float) - self.walk(boards, channels, amplitudes)
+
+    def to_dict(self):
+        return {
+            'degree': self.degree,
+            'reference_amplitude': self.reference_amplitude,
+            'coefficients': {f"{board}/{channel}": c for (board, channel), c in self.coefficients.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        correction = cls(d['degree'], d['reference_amplitude'])
+        for key, c in d['coefficients'].items():
+            board, channel = key.rsplit('/', 1)
+            correction.coefficients[(board, int(channel))] = c
+        return correction
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def store(self, db, dataset):
+        """Write the curves into a CalibrationDB as walk_c0, walk_c1, ... and walk_reference_amplitude"""
+        for (board, channel), coeffs in self.coefficients.items():
+            constants = {f"walk_c{i}": c for i, c in enumerate(coeffs)}
+            constants['walk_reference_amplitude'] = self.reference_amplitude
+            db.write_channel(board, channel, dataset, 'time_walk', constants, 0)
+
+
+def _channel_index(boards, channels):
+    """Sorted unique (board, channel) pairs and the position of each trace's pair in them"""
+    keys = list(zip(np.asarray(boards).tolist(), np.asarray(channels).tolist()))
+    unique = sorted(set(keys))
+    position = {key: i for i, key in enumerate(unique)}
+    return unique, np.array([position[key] for key in keys], dtype=int)
+
+
+def collect_timing(datasets, key='delay'):
+    """
+    Flat board, channel, amplitude and timing arrays from analysed traces, for fitting.
+    datasets is a list of (processor, waveform_type), e.g. the same board at several NHIT settings.
+    key is an analysis field such as 'delay' or 'output_t_low'; amplitude is output peak - pedestal.
+    delay is taken as output_t_low - input_t_low for traces analysed with calculate_rise_time,
+    which does not store it.
+    """
+    boards, channels, amplitudes, times = [], [], [], []
+    for processor, waveform_type in datasets:
+        for channel in sorted(processor.channels):
+            if waveform_type not in processor.channels[channel]:
+                continue
+            peak = processor.get_analysis_array(waveform_type, channel, 'output_peak')
+            pedestal = processor.get_analysis_array(waveform_type, channel, 'output_pedestal')
+            boards.append(np.full(len(peak), processor.name))
+            channels.append(np.full(len(peak), channel))
+            amplitudes.append(peak - pedestal)
+            channel_times = processor.get_analysis_array(waveform_type, channel, key)
+            if key == 'delay':
+                t_low = processor.get_analysis_array(waveform_type, channel, 'output_t_low') - processor.get_analysis_array(waveform_type, channel, 'input_t_low')
+                channel_times = np.where(np.isfinite(channel_times), channel_times, t_low)
+            if not np.isfinite(channel_times).any():
+                print(f"Warning: No {key} values for {processor.name} {waveform_type} channel {channel}")
+            times.append(channel_times)
+    if not channels:
+        return np.zeros(0, dtype=str), np.zeros(0, dtype=int), np.zeros(0), np.zeros(0)
+    return np.concatenate(boards), np.concatenate(channels), np.concatenate(amplitudes), np.concatenate(times)
+
+
+def corrected_delay_table(datasets, correction, key='delay'):
+    """Mean walk corrected timing per (board, channel) over all traces of the datasets"""
+    boards, channels, amplitudes, times = collect_timing(datasets, key)
+    corrected = correction.apply(boards, channels, amplitudes, times)
+    unique_channels, index = _channel_index(boards, channels)
+    finite = np.isfinite(corrected)
+    counts = np.bincount(index[finite], minlength=len(unique_channels))
+    sums = np.bincount(index[finite], weights=corrected[finite], minlength=len(unique_channels))
+    with np.errstate(invalid='ignore'):
+        means = sums / counts
+    return dict(zip(unique_channels, means.tolist()))
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+
+
+
+def batch_rise_times(time, signal, baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct, use_true_peak, counter_max=2):
+    """
+    Vectorized version of WaveformProcessor.calculate_rise_time for a traces x samples array.
+    Follows getPeakIndex, getLowCrossingTime and getHighCrossingTime trace by trace, so results
+    match the per-trace methods. Traces that never cross threshold give the same (nan/inf)
+    values the per-trace code does. Returns a dict of per-trace arrays.
+    """
+    signal = np.atleast_2d(signal)
+    time = np.broadcast_to(time, signal.shape)
+    n_traces, n_samples = signal.shape
+    rows = np.arange(n_traces)
+    start_idx = int(n_samples * baseline_start_pct)
+    end_idx = int(n_samples * baseline_end_pct)
+    pedestal = np.mean(signal[:, start_idx:end_idx+1], axis=1)
+
+    crossing = (signal - pedestal[:, None]) > threshold
+    crossed = crossing.any(axis=1)
+    threshold_index = np.where(crossed, np.argmax(crossing, axis=1), 0)
+
+    if use_true_peak:
+        peak_index = np.argmax(signal, axis=1)
+    else:
+        # First local peak after the threshold crossing, stepping through samples for all traces at once
+        peak_value = np.zeros(n_traces)
+        peak_index = np.zeros(n_traces, dtype=int)
+        counter = np.zeros(n_traces, dtype=int)
+        done = ~crossed
+        for i in range(threshold_index[crossed].min() if crossed.any() else n_samples, n_samples):
+            active = ~done & (i >= threshold_index)
+            counter += active & (signal[:, i] <= peak_value)
+            rising = active & (signal[:, i] > peak_value)
+            peak_value[rising] = signal[rising, i]
+            peak_index[rising] = i
+            done |= active & (counter > counter_max)
+            if done.all():
+                break
+
+    peak = signal[rows, peak_index]
+    amplitude = peak - pedestal
+    low_threshold = pedestal + amplitude * low_pct
+    high_threshold = pedestal + amplitude * high_pct
+    sample = np.arange(n_samples)
+
+    # Last sample below the low threshold at or before the threshold crossing
+    below = (signal < low_threshold[:, None]) & (sample <= threshold_index[:, None])
+    found = below.any(axis=1)
+    under = np.where(found, n_samples - 1 - np.argmax(below[:, ::-1], axis=1), 0)
+    over = np.where(found, np.minimum(under + 1, n_samples - 1), 0)
+    t_low = _interpolate_crossing(time, signal, low_threshold, rows, under, over)
+
+    # First sample above the high threshold at or after the threshold crossing
+    above = (signal > high_threshold[:, None]) & (sample >= threshold_index[:, None])
+    found = above.any(axis=1)
+    over = np.where(found, np.argmax(above, axis=1), 0)
+    under = np.where(found, over - 1, 0)
+    t_high = _interpolate_crossing(time, signal, high_threshold, rows, under, over)
+
+    return {
+        'rise_time': t_high - t_low,
+        't_low': t_low,
+        't_high': t_high,
+        'peak': peak,
+        'peak_index': peak_index,
+        'threshold_index': threshold_index,
+        'pedestal': pedestal,
+    }
+
+
+def _interpolate_crossing(time, signal, thresh, rows, under, over):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m = (signal[rows, over] - signal[rows, under]) / (time[rows, over] - time[rows, under])
+        return time[rows, under] + (thresh - signal[rows, under]) / m
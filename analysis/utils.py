@@ -1,28 +1,31 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 
 
 
-def plot_delays(boards, waveform_type):
+def get_board_delays(boards, waveform_type, key='output_t_low'):
+    """Per-channel mean of an analysis value over the good traces, e.g. key='output_template_time' after calculate_template_times"""
     board_delays = {}
     channels = []
-    
-    # Data collection
     for board in boards:
         delays = []
         channels = []  # Reset channels for each board
         for channel in sorted(board.channels.keys()):
             if waveform_type in board.channels[channel]:
                 channels.append(channel)
-                analysis = board.channels[channel][waveform_type][0]['analysis']
-                # print('--------------------------------')
-                # for key, val in analysis.items():
-                #     print(key,val)
-                # print('--------------------------------')
-                delays.append(analysis['output_t_low'])
+                delays.append(np.nanmean(board.get_analysis_array(waveform_type, channel, key)))
         board_delays[board.name] = delays
+    return channels, board_delays
+
+
+
+
+
+# Plotting functions import matplotlib on first use so the rest of the module stays headless
+def plot_delays(boards, waveform_type, key='output_t_low'):
+    import matplotlib.pyplot as plt
+    channels, board_delays = get_board_delays(boards, waveform_type, key)
 
     # Plotting
     plt.figure(figsize=(15, 8))
@@ -86,15 +89,14 @@ def plot_delays(boards, waveform_type):
 
 
 
-def histogram_board_rise_times(boards, waveform_type,low_pct,high_pct):
+def get_board_rise_times(boards, waveform_type):
     board_rise_times = {}
     for board in boards:
         rise_times = []
         for channel in board.channels:
             if waveform_type in board.channels[channel]:
-                for trace_num in board.channels[channel][waveform_type]:
-                    analysis = board.channels[channel][waveform_type][trace_num]['analysis']
-                    rise_times.append(analysis['output_rise_time'])
+                values = board.get_analysis_array(waveform_type, channel, 'output_rise_time')
+                rise_times.extend(values[np.isfinite(values)].tolist())
         board_rise_times[board.name] = rise_times
         # if board.name == 'CASB2':
         #     rise_times = []
@@ -104,6 +106,12 @@ def histogram_board_rise_times(boards, waveform_type,low_pct,high_pct):
         #                 analysis = board.channels[channel][waveform_type][trace_num]['analysis']
         #                 rise_times.append(analysis['input_rise_time'])
         #     board_rise_times['HVSS2'] = rise_times
+    return board_rise_times
+
+
+def histogram_board_rise_times(boards, waveform_type,low_pct,high_pct):
+    import matplotlib.pyplot as plt
+    board_rise_times = get_board_rise_times(boards, waveform_type)
     # Determine shared bins
     all_data = []
     for board in board_rise_times:
@@ -1,5 +1,18 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import matplotlib.pyplot as plt
+
+from calibration_db import CalibrationDB
+from filters import apply_filters
+from pulse_finder import find_pulses
+from quality import QUALITY_FLAGS, screen_traces, vertical_range
+from shared_traces import SharedTraceBuffer, RESULT_FIELDS, analyse_slice
+from template_fit import fit_template
+from timing import batch_rise_times
+
+# Screening flags: a record length that does not match the rest of the channel, then quality.screen_traces
+SCREEN_FLAGS = ['length'] + QUALITY_FLAGS
 
 class WaveformProcessor:
     """
@@ -8,10 +21,153 @@ class WaveformProcessor:
     def __init__(self, name=None):
         self.name = name or "Unnamed"
         self.channels = {}  # Main data structure
+        self.filter_config = None
+        self._filter_cache = {}
+        self.screening = {}
 
     def get_available_channels(self):
         return sorted(list(self.channels.keys()))
 
+    def add_trace(self, channel, waveform_type, trace_num, df, file=None, metadata=None, replace=False):
+        if channel not in self.channels:
+            self.channels[channel] = {}
+        if waveform_type not in self.channels[channel]:
+            self.channels[channel][waveform_type] = {}
+        if trace_num in self.channels[channel][waveform_type] and not replace:
+            raise ValueError(f"Channel {channel} already has trace {trace_num} in {waveform_type} data")
+        self.channels[channel][waveform_type][trace_num] = {
+            'data': df,
+            'analysis': {},
+            'file': file,
+            'metadata': metadata or {}
+        }
+        self.clear_filter_cache(channel, waveform_type)
+
+    def _common_length(self, waveform_type, channel, trace_indices, max_spread=2):
+        """
+        Length traces are cut to when stacked: the shortest of them. Gated records can differ by a
+        sample or two; a larger spread discards real samples, so it is reported.
+        """
+        traces = self.channels[channel][waveform_type]
+        lengths = [len(traces[t]['data']) for t in trace_indices]
+        if max(lengths) - min(lengths) > max_spread:
+            print(f"Warning: {self.name} {waveform_type} channel {channel} records range from {min(lengths)} to {max(lengths)} samples, "
+                  f"cutting all to {min(lengths)}. screen_channel rejects records of the wrong length.")
+        return min(lengths)
+
+    def get_trace_array(self, waveform_type, channel, column, trace_indices=None):
+        """
+        Stack the good traces of a channel (or the given ones) into traces x samples arrays,
+        ordered by trace number, cut to a common length (see _common_length).
+        Returns (trace_indices, time, signal) in the units stored in the data files.
+        """
+        if channel not in self.channels:
+            raise ValueError(f"Channel {channel} not found")
+        if waveform_type not in self.channels[channel]:
+            raise ValueError(f"Channel {channel} does not have {waveform_type} data")
+        traces = self.channels[channel][waveform_type]
+        trace_indices = np.array(sorted(self.get_good_traces(waveform_type, channel) if trace_indices is None else trace_indices))
+        if len(trace_indices) == 0:
+            raise ValueError(f"Channel {channel} has no good {waveform_type} traces")
+        n_samples = self._common_length(waveform_type, channel, trace_indices)
+        time = np.stack([traces[t]['data']["time"].values[:n_samples] for t in trace_indices])
+        signal = np.stack([traces[t]['data'][column].values[:n_samples] for t in trace_indices])
+        return trace_indices, time, signal
+
+    def get_good_traces(self, waveform_type, channel):
+        """Trace numbers of a channel that were not rejected by screen_channel"""
+        traces = self.channels[channel][waveform_type]
+        return [t for t in sorted(traces) if traces[t].get('good', True)]
+
+    def screen_channel(self, waveform_type, channel, baseline_start_pct, baseline_end_pct, threshold, output=True, length_tolerance=2, **kwargs):
+        """
+        Flag saturated, clipped, empty, unstable or unparsed traces of a channel in one pass,
+        see quality.screen_traces (extra keyword arguments are passed on). Records more than
+        length_tolerance samples longer or shorter than the channel's median are flagged 'length'
+        first, so a truncated file does not cut the rest. Rejected traces are marked so the
+        analysis skips them. Threshold is in mV.
+        Clipping uses the Tek header vertical settings, which describe the first scope channel (output).
+        Returns the rejection summary for the channel.
+        """
+        column = "output" if output else "input"
+        traces = self.channels[channel][waveform_type]
+        all_indices = sorted(traces)
+        lengths = np.array([len(traces[t]['data']) for t in all_indices])
+        wrong_length = np.abs(lengths - np.median(lengths)) > length_tolerance
+        for trace_index in np.array(all_indices)[wrong_length]:
+            traces[trace_index]['good'] = False
+            traces[trace_index]['quality'] = ['length']
+        self.clear_filter_cache(channel, waveform_type)
+        summary = {flag: 0 for flag in SCREEN_FLAGS}
+        summary['length'] = int(wrong_length.sum())
+        summary['total'] = len(all_indices)
+        summary['good'] = 0
+        self.screening.setdefault(waveform_type, {})[channel] = summary
+        if wrong_length.all():
+            return summary
+        trace_indices, _, signal = self.get_trace_array(waveform_type, channel, column, np.array(all_indices)[~wrong_length])
+        limits = None
+        if output:
+            ranges = [vertical_range(traces[t].get('metadata', {})) for t in trace_indices]
+            if all(r is not None for r in ranges):
+                limits = tuple(np.array(ranges).T * 1e3)
+        flags = screen_traces(signal * 1e3, baseline_start_pct, baseline_end_pct, threshold, limits, **kwargs)
+        for row, trace_index in enumerate(trace_indices):
+            traces[trace_index]['good'] = bool(flags['good'][row])
+            traces[trace_index]['quality'] = [flag for flag in QUALITY_FLAGS if flags[flag][row]]
+        summary.update({flag: int(flags[flag].sum()) for flag in QUALITY_FLAGS})
+        summary['good'] = int(flags['good'].sum())
+        return summary
+
+    def screen_all_channels(self, waveform_type, baseline_start_pct, baseline_end_pct, threshold, output=True, **kwargs):
+        summaries = {}
+        for channel in sorted(self.channels):
+            if waveform_type in self.channels[channel]:
+                summaries[channel] = self.screen_channel(waveform_type, channel, baseline_start_pct, baseline_end_pct, threshold, output, **kwargs)
+        rejected = sum(s['total'] - s['good'] for s in summaries.values())
+        print(f"Rejected {rejected} of {sum(s['total'] for s in summaries.values())} {waveform_type} traces for {self.name}")
+        for channel, s in summaries.items():
+            if s['good'] < s['total']:
+                reasons = ", ".join(f"{s[flag]} {flag}" for flag in SCREEN_FLAGS if s[flag])
+                print(f"  channel {channel}: {s['total'] - s['good']}/{s['total']} rejected ({reasons})")
+        return summaries
+
+    def set_filter(self, fir=None, iir=None, blr_tau=None, pedestal=None):
+        """
+        Configure the preprocessing applied before timing analysis, see filters.apply_filters.
+        blr_tau is in ns. Call with no arguments to go back to the raw samples.
+        """
+        if fir is None and iir is None and blr_tau is None and pedestal is None:
+            self.filter_config = None
+        else:
+            self.filter_config = {
+                'fir': fir if fir is None or np.isscalar(fir) else tuple(fir),
+                'iir': None if iir is None else (tuple(iir[0]), tuple(iir[1])),
+                'blr_tau': blr_tau,
+                'pedestal': None if pedestal is None else tuple(pedestal),
+            }
+
+    def clear_filter_cache(self, channel=None, waveform_type=None):
+        for key in list(self._filter_cache):
+            if (channel is None or key[1] == channel) and (waveform_type is None or key[0] == waveform_type):
+                del self._filter_cache[key]
+
+    def get_filtered_traces(self, waveform_type, channel, column):
+        """
+        Filter every good trace of a channel in one call using the current filter configuration.
+        Results are cached until the configuration changes, traces are added or the channel is screened.
+        Returns (trace_indices, time, filtered_signal) like get_trace_array.
+        """
+        config = self.filter_config or {}
+        key = (waveform_type, channel, column, tuple(sorted(config.items())))
+        if key not in self._filter_cache:
+            trace_indices, time, signal = self.get_trace_array(waveform_type, channel, column)
+            if config:
+                dt = np.median(np.diff(time[0])) * 1e9
+                signal = apply_filters(signal, dt, config['fir'], config['iir'], config['blr_tau'], config['pedestal'])
+            self._filter_cache[key] = (trace_indices, time, signal)
+        return self._filter_cache[key]
+
     def get_trace_data(self, waveform_type, channel, trace_index):
         if channel not in self.channels:
             raise ValueError(f"Channel {channel} not found")  
@@ -30,6 +186,34 @@ class WaveformProcessor:
             raise ValueError(f"Channel {channel} does not have trace {trace_index} in {waveform_type} data. There are {len(self.channels[channel][waveform_type].keys())} traces available.")
         return self.channels[channel][waveform_type][trace_index]['analysis']
 
+    def get_analysis_array(self, waveform_type, channel, key):
+        """One analysis value per good trace of a channel, nan where it was not computed"""
+        traces = self.channels[channel][waveform_type]
+        return np.array([traces[t]['analysis'].get(key, np.nan) for t in self.get_good_traces(waveform_type, channel)], dtype=float)
+
+    def get_processed_trace(self, waveform_type, channel, trace_index):
+        """
+        A trace's data as the analysis sees it: the stored DataFrame, or with a filter set the
+        filtered output and input, cut to the channel's shortest good trace like get_filtered_traces.
+        Rejected traces are filtered on their own at full length. Units as in the data files.
+        """
+        df = self.get_trace_data(waveform_type, channel, trace_index)
+        if self.filter_config is None:
+            return df
+        import pandas as pd  # only here, so the numeric core and its workers load without pandas
+        columns = [c for c in ("output", "input") if c in df.columns]
+        if trace_index not in self.get_good_traces(waveform_type, channel):
+            config = self.filter_config
+            dt = np.median(np.diff(df["time"].values)) * 1e9
+            filtered = apply_filters(df[columns].values.T, dt, config['fir'], config['iir'], config['blr_tau'], config['pedestal'])
+            return pd.DataFrame({"time": df["time"].values, **dict(zip(columns, filtered))})
+        processed = {}
+        for column in columns:
+            trace_indices, time, filtered = self.get_filtered_traces(waveform_type, channel, column)
+            row = np.searchsorted(trace_indices, trace_index)
+            processed[column] = filtered[row]
+        return pd.DataFrame({"time": time[row], **processed})
+
     def get_pedestal(self, data, baseline_start_pct, baseline_end_pct):
         start_idx = int(len(data) * baseline_start_pct)
         end_idx = int(len(data) * baseline_end_pct)
@@ -92,7 +276,7 @@ class WaveformProcessor:
         return cross_time
 
     def calculate_rise_time(self, channel, waveform_type, trace_index, baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct,use_true_peak,output,input):
-        df = self.get_trace_data(waveform_type, channel, trace_index)
+        df = self.get_processed_trace(waveform_type, channel, trace_index)
         time = df["time"].values * 1e9 # Convert to ns
         if output:
             signal = df["output"].values * 1e3 # Convert to mV
@@ -139,7 +323,8 @@ class WaveformProcessor:
         for channel in self.channels:
             try:
                 if waveform_type in self.channels[channel]:
-                    for trace_index in range(len(self.channels[channel][waveform_type])):
+                    results[channel] = np.nan # Stays nan if every trace was rejected
+                    for trace_index in self.get_good_traces(waveform_type, channel):
                         rt, t_low, t_high = self.calculate_rise_time(channel,waveform_type,trace_index,baseline_start_pct,baseline_end_pct,threshold,low_pct,high_pct,use_true_peak,output,input)
                         results[channel] = rt
                 else:
@@ -149,6 +334,218 @@ class WaveformProcessor:
                 results[channel] = np.nan
         return results
     
+    def calculate_batch_rise_times(self, waveform_type, channel, trace_indices, baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct, use_true_peak):
+        """
+        Vectorized calculate_rise_time for a set of traces of one channel, for the output and,
+        when present, the input. Only these traces are filtered, so it suits data arriving in batches.
+        Results go into the analysis dicts like calculate_rise_time, plus delay and gain.
+        Traces rejected by screen_channel are left out.
+        """
+        traces = self.channels[channel][waveform_type]
+        trace_indices = [t for t in trace_indices if traces[t].get('good', True)]
+        if not trace_indices:
+            return {}
+        n_samples = self._common_length(waveform_type, channel, trace_indices)
+        time = np.stack([traces[t]['data']["time"].values[:n_samples] for t in trace_indices]) * 1e9 # Convert to ns
+        dt = np.median(np.diff(time[0]))
+        columns = [c for c in ("output", "input") if c in traces[trace_indices[0]]['data'].columns]
+        results = {}
+        for column in columns:
+            signal = np.stack([traces[t]['data'][column].values[:n_samples] for t in trace_indices])
+            if self.filter_config is not None:
+                config = self.filter_config
+                signal = apply_filters(signal, dt, config['fir'], config['iir'], config['blr_tau'], config['pedestal'])
+            for key, values in batch_rise_times(time, signal * 1e3, baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct, use_true_peak).items():
+                results[f"{column}_{key}"] = values
+        if "input" in columns:
+            results["delay"] = results["output_t_low"] - results["input_t_low"]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                results["gain"] = (results["output_peak"] - results["output_pedestal"]) / (results["input_peak"] - results["input_pedestal"])
+        for row, trace_index in enumerate(trace_indices):
+            traces[trace_index]['analysis'].update({key: values[row].item() for key, values in results.items()})
+        return results
+
+    def share_traces(self, waveform_type, channel, path=None):
+        """
+        Copy a channel's good (filtered) traces once into a shared (column x trace x sample) buffer
+        for worker processes. Uses POSIX shared memory, or a memory-mapped .npy file at path.
+        Returns (trace_indices, columns, buffer); the caller must unlink() the buffer when done.
+        """
+        columns = ["time"] + [c for c in ("output", "input") if c in next(iter(self.channels[channel][waveform_type].values()))['data'].columns]
+        # Time is the unfiltered get_trace_array time that comes with the output, never filtered itself
+        trace_indices, time, _ = self.get_filtered_traces(waveform_type, channel, "output")
+        keep = np.isin(trace_indices, self.get_good_traces(waveform_type, channel))
+        arrays = [time[keep]] + [self.get_filtered_traces(waveform_type, channel, c)[2][keep] for c in columns[1:]]
+        return trace_indices[keep], columns, SharedTraceBuffer.from_array(np.stack(arrays), path)
+
+    def calculate_all_rise_times_parallel(self, waveform_type, baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct, use_true_peak, processes=None, path=None):
+        """
+        calculate_rise_time for the output and input of every trace, spread over worker processes.
+        Traces go to the workers through shared buffers (memory-mapped files in the directory
+        path if given) and results come back through a shared array, so nothing is pickled but
+        descriptors. Results are stored in the analysis dicts as usual, plus delay and gain.
+        Returns the mean output rise time per channel.
+        """
+        processes = processes or os.cpu_count()
+        params = (baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct, use_true_peak)
+        jobs = {}
+        results = {}
+        with ProcessPoolExecutor(processes) as pool:
+            try:
+                for channel in sorted(self.channels):
+                    if waveform_type not in self.channels[channel] or not self.get_good_traces(waveform_type, channel):
+                        results[channel] = np.nan
+                        continue
+                    trace_path = None if path is None else os.path.join(path, f"{self.name}_{waveform_type}_ch{channel}_traces.npy")
+                    result_path = None if path is None else os.path.join(path, f"{self.name}_{waveform_type}_ch{channel}_results.npy")
+                    traces = output = None
+                    try:
+                        trace_indices, columns, traces = self.share_traces(waveform_type, channel, trace_path)
+                        output = SharedTraceBuffer.create((len(trace_indices), len(RESULT_FIELDS)), np.float64, result_path)
+                        output.array[...] = np.nan
+                        chunk = -(-len(trace_indices) // processes)
+                        futures = [pool.submit(analyse_slice, traces.descriptor, output.descriptor, columns, start, min(start + chunk, len(trace_indices)), params)
+                                   for start in range(0, len(trace_indices), chunk)]
+                        jobs[channel] = (trace_indices, traces, output, futures)
+                    except Exception as e:
+                        print(f"Error processing {self.name} {waveform_type} channel {channel}: {e}")
+                        results[channel] = np.nan
+                        for buffer in (traces, output):
+                            if buffer is not None:
+                                buffer.unlink()
+                for channel, (trace_indices, traces, output, futures) in jobs.items():
+                    try:
+                        for future in futures:
+                            future.result()
+                        for row, trace_index in enumerate(trace_indices):
+                            values = dict(zip(RESULT_FIELDS, output.array[row].tolist()))
+                            analysis = {k: int(v) if k.endswith("_index") and not np.isnan(v) else v for k, v in values.items() if not np.isnan(v)}
+                            self.channels[channel][waveform_type][trace_index]['analysis'].update(analysis)
+                        results[channel] = np.nanmean(output.array[:, RESULT_FIELDS.index("output_rise_time")])
+                    except Exception as e:
+                        print(f"Error processing {self.name} {waveform_type} channel {channel}: {e}")
+                        results[channel] = np.nan
+            finally:
+                for trace_indices, traces, output, futures in jobs.values():
+                    traces.unlink()
+                    output.unlink()
+        return results
+
+    def update_calibration_db(self, db, waveform_type, dataset, baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct, use_true_peak):
+        """
+        Write per-channel averages of rise time, delay and gain into a CalibrationDB.
+        Channels whose input files and good (screened) traces have not changed since the last
+        update with the same parameters are skipped. Returns the list of channels that were recomputed.
+        """
+        params = {
+            'waveform_type': waveform_type,
+            'baseline_start_pct': baseline_start_pct,
+            'baseline_end_pct': baseline_end_pct,
+            'threshold': threshold,
+            'low_pct': low_pct,
+            'high_pct': high_pct,
+            'use_true_peak': use_true_peak,
+            'filter': None if self.filter_config is None else repr(sorted(self.filter_config.items())),
+        }
+        param_set = CalibrationDB.make_param_set(params)
+        updated = []
+        for channel in sorted(self.channels):
+            if waveform_type not in self.channels[channel]:
+                continue
+            traces = self.channels[channel][waveform_type]
+            good = self.get_good_traces(waveform_type, channel)
+            fingerprint = CalibrationDB.fingerprint([trace.get('file') for trace in traces.values()], good)
+            if db.is_current(self.name, channel, dataset, param_set, fingerprint):
+                continue
+            rows = []
+            for trace_index in good:
+                try:
+                    self.calculate_rise_time(channel, waveform_type, trace_index, baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct, use_true_peak, True, False)
+                    if "input" in traces[trace_index]['data'].columns:
+                        self.calculate_rise_time(channel, waveform_type, trace_index, baseline_start_pct, baseline_end_pct, threshold, low_pct, high_pct, use_true_peak, False, True)
+                    rows.append(traces[trace_index]['analysis'])
+                except Exception as e:
+                    print(f"Error processing {self.name} {waveform_type} channel {channel} trace {trace_index}: {e}")
+            if not rows:
+                # Nothing usable left, e.g. every trace was rejected: clear the old constants
+                db.write_channel(self.name, channel, dataset, param_set, {}, 0, fingerprint)
+                updated.append(channel)
+                continue
+            output_amplitude = np.array([a['output_peak'] - a['output_pedestal'] for a in rows])
+            constants = {
+                'rise_time': np.nanmean([a['output_rise_time'] for a in rows]),
+                't_low': np.nanmean([a['output_t_low'] for a in rows]),
+                'amplitude': np.nanmean(output_amplitude),
+            }
+            if all('input_t_low' in a for a in rows):
+                delays = np.array([a['output_t_low'] - a['input_t_low'] for a in rows])
+                input_amplitude = np.array([a['input_peak'] - a['input_pedestal'] for a in rows])
+                constants.update({
+                    'input_rise_time': np.nanmean([a['input_rise_time'] for a in rows]),
+                    'delay': np.nanmean(delays),
+                    'delay_std': np.nanstd(delays),
+                    'gain': np.nanmean(output_amplitude / input_amplitude),
+                })
+            db.write_channel(self.name, channel, dataset, param_set, constants, len(rows), fingerprint)
+            updated.append(channel)
+        return updated
+    
+    def find_all_pulses(self, waveform_type, channel, baseline_start_pct, baseline_end_pct, threshold, output=True, min_width=1, rearm_threshold=None, min_gap=5):
+        """
+        Find every pulse in every trace of a channel, see pulse_finder.find_pulses.
+        Runs on the filtered traces when a filter is set. Times are in ns and amplitudes in mV,
+        thresholds included. The result also has trace_index, the trace number each pulse belongs to.
+        """
+        column = "output" if output else "input"
+        trace_indices, time, signal = self.get_filtered_traces(waveform_type, channel, column)
+        pulses = find_pulses(time * 1e9, signal * 1e3, threshold, baseline_start_pct, baseline_end_pct, min_width,
+                             rearm_threshold, min_gap)
+        pulses['trace_index'] = trace_indices[pulses['trace']]
+        return pulses
+    
+    def calculate_template_times(self, waveform_type, template_type, baseline_start_pct, baseline_end_pct, fraction=0.2, max_shift=None,
+                                 window=(5, 20), min_correlation=0.9, max_chi2=5):
+        """
+        Time every good trace against its channel's template_type traces (averaged together when a
+        channel has several), see template_fit.fit_template. Output and input are fitted when both
+        have them. Stores output_template_time, _amplitude, _correlation and _chi2 (and input_...)
+        in the analysis dicts, in ns and mV, plus template_delay. Times are where the fitted pulse
+        reaches fraction of its peak. max_shift and the template window (before, after) are in ns.
+        Fits with correlation below min_correlation or chi2 above max_chi2 get nan times and amplitudes.
+        Returns the mean output template time per channel.
+        """
+        results = {}
+        for channel in sorted(self.channels):
+            if waveform_type not in self.channels[channel] or template_type not in self.channels[channel]:
+                continue
+            try:
+                traces = self.channels[channel][waveform_type]
+                good = self.get_good_traces(waveform_type, channel)
+                trace_columns = next(iter(traces.values()))['data'].columns
+                template_columns = next(iter(self.channels[channel][template_type].values()))['data'].columns
+                fits = {}
+                for column in [c for c in ("output", "input") if c in trace_columns and c in template_columns]:
+                    trace_indices, time, signal = self.get_filtered_traces(waveform_type, channel, column)
+                    keep = np.isin(trace_indices, good)
+                    _, template_time, template = self.get_filtered_traces(template_type, channel, column)
+                    fit = fit_template(time[keep] * 1e9, signal[keep] * 1e3, template_time[0] * 1e9, template.mean(axis=0) * 1e3,
+                                       baseline_start_pct, baseline_end_pct, fraction, max_shift,
+                                       window=window, min_correlation=min_correlation, max_chi2=max_chi2)
+                    rejected = int(np.sum(np.isnan(fit['time'])))
+                    if rejected:
+                        print(f"Rejected {rejected} of {int(keep.sum())} {column} template fits for {self.name} {waveform_type} channel {channel}")
+                    for key in ('time', 'amplitude', 'correlation', 'chi2'):
+                        fits[f"{column}_template_{key}"] = fit[key]
+                if "input_template_time" in fits:
+                    fits["template_delay"] = fits["output_template_time"] - fits["input_template_time"]
+                for row, trace_index in enumerate(trace_indices[keep]):
+                    traces[trace_index]['analysis'].update({key: values[row].item() for key, values in fits.items()})
+                results[channel] = np.nanmean(fits["output_template_time"])
+            except Exception as e:
+                print(f"Error processing {self.name} {waveform_type} channel {channel}: {e}")
+                results[channel] = np.nan
+        return results
+    
     # # Uses rise time low crossing time to calculate delay, so must be called after calculating rise times   
     # def calculate_delay(self,waveform_type,trace_index):
     #     for channel in self.channels:
@@ -221,9 +618,12 @@ class WaveformProcessor:
     #             gains[ch] = np.nan
     #     return gains
     
+    # Plotting imports matplotlib on first use, so the analysis can run in headless workers
+    # without paying for (or configuring) a plotting backend
     def plot_waveform(self, channel, waveform_type, trace_index, show_rise_time_analysis,output,input,lineup=False):
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(figsize=(10, 6))
-        df = self.get_trace_data(waveform_type, channel, trace_index)
+        df = self.get_processed_trace(waveform_type, channel, trace_index)
         analysis = self.get_trace_analysis(waveform_type, channel, trace_index)
         time_ns = df["time"].values*1e9  
         if lineup and output and input and not show_rise_time_analysis:
@@ -258,17 +658,18 @@ class WaveformProcessor:
         return fig
 
     def plot_all_waveforms(self, waveform_type, show_rise_time_analysis=False,output=True,input=False,lineup=False):
+        import matplotlib.pyplot as plt
         available_traces = []
         for channel in self.channels:
             if waveform_type in self.channels[channel]:
-                for trace_index in range(len(self.channels[channel][waveform_type])):
-                    available_traces.append(self.channels[channel][waveform_type][trace_index])
+                for trace_index in self.get_good_traces(waveform_type, channel):
+                    available_traces.append((channel, trace_index))
         n_cols = 4
         n_rows = len(available_traces)//n_cols+1
         fig, axs = plt.subplots(n_rows, n_cols, figsize=(20,5*n_rows))
-        for i, trace in enumerate(available_traces):
-            df=trace['data']
-            analysis=trace['analysis']
+        for i, (channel, trace_index) in enumerate(available_traces):
+            df=self.get_processed_trace(waveform_type, channel, trace_index)
+            analysis=self.channels[channel][waveform_type][trace_index]['analysis']
             ax = axs[i//n_cols, i%n_cols]
             if lineup and output and input and not show_rise_time_analysis:
                 time_diff = analysis['output_t_low']-analysis['input_t_low']
@@ -292,7 +693,7 @@ class WaveformProcessor:
                         ax.axvline(x=analysis['input_t_high'], color='orange', linestyle='--') 
                         ax.axhline(y=0, color='grey', linestyle='--')
                         ax.axhline(y=analysis['input_peak']-analysis['input_pedestal'], color='orange', linestyle='--')
-            ax.set_title(f"{self.name} channel {channel} {waveform_type} trace {i} ")
+            ax.set_title(f"{self.name} channel {channel} {waveform_type} trace {trace_index} ")
             ax.set_xlabel('Time (ns)')
             ax.set_ylabel('Amplitude (mV)')
             ax.legend()